@@ -3,9 +3,12 @@ import os
 os.environ['LIBCAMERA_LOG_LEVELS'] = "*:ERROR"
 
 import argparse
+import json
 from pprint import pprint
 from picamera2 import Picamera2
 
+from rcam.server import camera_cache
+
 
 def print_dict(data):
     maxk = max([len(k) for k in data.keys()])
@@ -14,20 +17,17 @@ def print_dict(data):
         print(f"    {k:>{maxk}}: {v}")
 
 
-def camera_info(cam_id):
-    
+def probe_camera(cam_id):
+
     picam2 = Picamera2(cam_id)
-    
-    # collect all the camera information
-    cam_properties = picam2.camera_properties
-    cam_controls = picam2.camera_controls
 
+    # collect all the camera information
     sensor_modes = []
     for sensor_mode in picam2.sensor_modes:
         sensor_modes.append(sensor_mode)
-    
+
     kwargs = {}
-    if hasattr(picam2.still_configuration, 'sensor'):    
+    if hasattr(picam2.still_configuration, 'sensor'):
         kwargs['sensor'] = {
             'output_size': sensor_modes[2]['size'],
             'bit_depth': sensor_modes[2]['bit_depth']
@@ -37,8 +37,7 @@ def camera_info(cam_id):
     picam2.align_configuration(still_cfg)
     picam2.configure(still_cfg)
 
-    cam_properties = picam2.camera_properties.copy()
-    cam_controls = picam2.camera_controls.copy()
+    info = camera_cache.probe(picam2)
 
     preview_cfg = picam2.create_preview_configuration()
     picam2.align_configuration(preview_cfg)
@@ -46,59 +45,98 @@ def camera_info(cam_id):
     video_cfg = picam2.create_video_configuration()
     picam2.align_configuration(video_cfg)
 
+    info['report'] = {
+        'still': still_cfg,
+        'preview': preview_cfg,
+        'video': video_cfg,
+        'main_stream': picam2.stream_configuration("main")
+    }
+
+    picam2.close()
+
+    return info
+
+
+def camera_info(cam_id, refresh):
+
+    # use the cached information if there is any
+    key = camera_cache.cache_key(cam_id)
+    info = None if refresh else camera_cache.load(key)
+
+    if info is None or 'report' not in info:
+        probed = probe_camera(cam_id)
+
+        # keep any configurations the server has already cached
+        if info is not None:
+            probed['configurations'] = info.get('configurations', {})
+
+        camera_cache.save(key, probed)
+        info = camera_cache.load(key)
 
+    return info
+
+
+def print_info(info):
     # display the information
     print()
-    
+
     print("  Properties:")
-    print_dict(cam_properties)
+    print_dict(info['properties'])
     print()
 
     print("  Controls:")
-    print_dict(cam_controls)
+    print_dict(info['controls'])
     print()
 
-    for idx, sensor_mode in enumerate(sensor_modes):
+    for idx, sensor_mode in enumerate(info['sensor_modes']):
         print(f"  Sensor Mode {idx}:")
         print_dict(sensor_mode)
         print()
-    
+
+    report = info['report']
+
     print("  Still Configuration:")
-    print_dict(still_cfg)
+    print_dict(report['still'])
     print()
 
     print("  Preview Configuration:")
-    print_dict(preview_cfg)
+    print_dict(report['preview'])
     print()
-    
+
     print("  Video Configuration:")
-    print_dict(video_cfg)
+    print_dict(report['video'])
     print()
-    
+
     print("  Main Stream Configuration:")
-    print_dict(picam2.stream_configuration("main"))
+    print_dict(report['main_stream'])
     print()
 
-    
+
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument('-c', '--camera', help='the camera to query', type=int, default=-1)
+    parser.add_argument('--json', help='print the information as json', action='store_true')
+    parser.add_argument('--refresh', help='query the camera even if the information is cached', action='store_true')
     args = parser.parse_args()
-    
+
     if args.camera != -1:
-        print(f"Camera {args.camera}")
-        camera_info(args.camera)
-        
+        cam_ids = [args.camera]
     else:
         cameras = Picamera2.global_camera_info()
-        for idx, camera in enumerate(cameras):
-            cam_id = camera.get('Num', idx)
-        
+        cam_ids = [camera.get('Num', idx) for idx, camera in enumerate(cameras)]
+
+    infos = { cam_id: camera_info(cam_id, args.refresh) for cam_id in cam_ids }
+
+    if args.json:
+        print(json.dumps(infos, indent=2))
+        return
+
+    for cam_id, info in infos.items():
+        if args.camera == -1:
             print("------------------------------------------------")
-            print(f"Camera {cam_id}")
-            camera_info(cam_id)    
+        print(f"Camera {cam_id}")
+        print_info(info)
 
 
 if __name__ == "__main__":
     main()
-
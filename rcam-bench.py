@@ -0,0 +1,257 @@
+#!/usr/bin/env python3
+import argparse
+import json
+import platform
+import statistics
+import sys
+import threading
+import time
+from datetime import datetime
+
+import zmq
+import numpy as np
+
+from rcam import rgbimg
+from rcam.server.operators import fit_cropped, fit_scaled, jpeg_encoder, rgb_encoder, publisher
+from rcam.server.operators_raw import raw_linear8, raw_gamma8
+
+
+resolutions = {
+    'vga': (640, 480),
+    '1080p': (1920, 1080),
+    '12mp': (4056, 3040),
+}
+
+# the size the viewer typically asks for
+view_size = (1280, 720)
+
+raw_formats = {
+    'SBGGR10': 1023,
+    'SBGGR16': 65535,
+}
+
+
+def synthetic_rgb(size):
+    # a gradient with some noise so the encoder has realistic work to do
+    w, h = size
+    rng = np.random.default_rng(0)
+    x = np.linspace(0, 255, w, dtype=np.float32)[None, :, None]
+    y = np.linspace(0, 255, h, dtype=np.float32)[:, None, None]
+    image = (x + y) / 2 + rng.normal(0, 8, (h, w, 3))
+    return np.clip(image, 0, 255).astype(np.uint8)
+
+
+def synthetic_raw(size, max_value):
+    w, h = size
+    rng = np.random.default_rng(0)
+    return rng.integers(64, max_value, (h, w), dtype=np.uint16)
+
+
+def source(frames, image_key, image, image_format, controls):
+    for idx in range(frames):
+        item = {
+            'idx': idx,
+            'controls': controls if idx == 0 else {},
+            'metadata': {
+                'SensorBlackLevels': [4096, 4096, 4096, 4096],
+                'AnalogueGain': 1.0,
+                'ExposureTime': 10000,
+            },
+            image_key: {
+                'image': image,
+                'format': image_format
+            }
+        }
+        yield item
+
+
+def with_jpeg(pipe, jpeg):
+    for item in pipe:
+        item['jpeg'] = jpeg
+        yield item
+
+
+def time_pipe(pipe, warmup):
+    times = []
+    start = time.perf_counter()
+    for idx, item in enumerate(pipe):
+        now = time.perf_counter()
+        if idx >= warmup:
+            times.append(now - start)
+        start = now
+    return times
+
+
+def bench_cases():
+    """Yield (name, pipe builder) for every case in the matrix."""
+
+    fit_controls = {'Width': view_size[0], 'Height': view_size[1]}
+
+    for res_name, size in resolutions.items():
+        rgb = synthetic_rgb(size)
+
+        for fit_mode, fit_op in (('cropped', fit_cropped), ('scaled', fit_scaled)):
+            controls = dict(fit_controls, FitMode=fit_mode)
+            yield (f"fit_{fit_mode}/{res_name}/uint8/{fit_mode}",
+                   lambda n, rgb=rgb, controls=controls, fit_op=fit_op: fit_op(source(n, 'main', rgb, 'BGR888', controls), enabled=True))
+
+        for fit_mode in ('none', 'scaled'):
+            image = rgb
+            if fit_mode == 'scaled':
+                scale = min(view_size[0]/size[0], view_size[1]/size[1], 1.0)
+                image = rgb[::max(1, int(1/scale)), ::max(1, int(1/scale))].copy()
+            yield (f"jpeg_encoder/{res_name}/uint8/{fit_mode}",
+                   lambda n, image=image: jpeg_encoder(source(n, 'main', image, 'BGR888', {})))
+
+        for compression in rgbimg.available:
+            yield (f"rgb_encoder/{res_name}/uint8/{compression}",
+                   lambda n, rgb=rgb, compression=compression: rgb_encoder(source(n, 'main', rgb, 'BGR888', {}), compression=compression))
+
+        for raw_format, max_value in raw_formats.items():
+            raw = synthetic_raw(size, max_value)
+            for op_name, raw_op in (('raw_linear8', raw_linear8), ('raw_gamma8', raw_gamma8)):
+                yield (f"{op_name}/{res_name}/{raw_format}/none",
+                       lambda n, raw=raw, raw_format=raw_format, raw_op=raw_op: raw_op(source(n, 'raw', raw, raw_format, {})))
+
+
+def bench_publisher(frames, warmup, name_filter):
+    """Publish real jpeg sizes to a subscriber draining an inproc socket."""
+
+    context = zmq.Context()
+    pub_sock = context.socket(zmq.PUB)
+    pub_sock.set_hwm(2)
+    pub_sock.bind("inproc://bench")
+
+    sub_sock = context.socket(zmq.SUB)
+    sub_sock.set_hwm(2)
+    sub_sock.connect("inproc://bench")
+    sub_sock.setsockopt(zmq.SUBSCRIBE, b'')
+
+    over = threading.Event()
+
+    def drain():
+        while not over.is_set():
+            if sub_sock.poll(timeout=50, flags=zmq.POLLIN):
+                sub_sock.recv_multipart()
+
+    drainer = threading.Thread(target=drain)
+    drainer.start()
+
+    results = {}
+    for res_name, size in resolutions.items():
+        name = f"publisher/{res_name}/uint8/none"
+        if name_filter and name_filter not in name:
+            continue
+
+        jpeg = next(jpeg_encoder(source(1, 'main', synthetic_rgb(size), 'BGR888', {})))['jpeg']
+        pipe = publisher(with_jpeg(source(frames + warmup, 'main', None, 'BGR888', {}), jpeg), pub_sock)
+        results[name] = time_pipe(pipe, warmup)
+
+    over.set()
+    drainer.join()
+    context.destroy(linger=0)
+
+    return results
+
+
+def summarise(times):
+    median = statistics.median(times)
+    return {
+        'frames': len(times),
+        'mean_ms': statistics.fmean(times) * 1000,
+        'median_ms': median * 1000,
+        'min_ms': min(times) * 1000,
+        'fps': 1.0 / median if median > 0 else 0.0,
+    }
+
+
+def run(args):
+    results = {}
+
+    for name, build in bench_cases():
+        if args.filter and args.filter not in name:
+            continue
+        times = time_pipe(build(args.frames + args.warmup), args.warmup)
+        results[name] = summarise(times)
+        print(f"{name:>40}: {results[name]['median_ms']:9.3f} ms")
+
+    for name, times in bench_publisher(args.frames, args.warmup, args.filter).items():
+        results[name] = summarise(times)
+        print(f"{name:>40}: {results[name]['median_ms']:9.3f} ms")
+
+    baseline = {
+        'meta': {
+            'created': datetime.now().isoformat(timespec='seconds'),
+            'machine': platform.machine(),
+            'node': platform.node(),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+        },
+        'results': results
+    }
+
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump(baseline, f, indent=2, sort_keys=True)
+        print(f"saved to {args.output}")
+
+    return 0
+
+
+def compare(args):
+    with open(args.baseline) as f:
+        baseline = json.load(f)['results']
+    with open(args.current) as f:
+        current = json.load(f)['results']
+
+    regressions = 0
+    for name in sorted(baseline.keys() & current.keys()):
+        base_ms = baseline[name]['median_ms']
+        cur_ms = current[name]['median_ms']
+        change = (cur_ms - base_ms) / base_ms * 100.0 if base_ms > 0 else 0.0
+
+        # very fast cases are mostly timer noise
+        flag = ""
+        if abs(cur_ms - base_ms) < args.min_delta:
+            pass
+        elif change > args.threshold:
+            flag = "  REGRESSION"
+            regressions += 1
+        elif change < -args.threshold:
+            flag = "  improved"
+
+        print(f"{name:>40}: {base_ms:9.3f} -> {cur_ms:9.3f} ms ({change:+6.1f}%){flag}")
+
+    for name in sorted(baseline.keys() - current.keys()):
+        print(f"{name:>40}: missing from {args.current}")
+
+    print(f"{regressions} regression(s) beyond {args.threshold}%")
+    return 1 if regressions else 0
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = subparsers.add_parser('run', help='run the benchmarks')
+    run_parser.add_argument('-n', '--frames', help='frames to time per case', type=int, default=20)
+    run_parser.add_argument('-w', '--warmup', help='frames to run before timing', type=int, default=3)
+    run_parser.add_argument('-f', '--filter', help='only run cases containing this string', type=str, default=None)
+    run_parser.add_argument('-o', '--output', help='save the results as a json baseline', type=str, default=None)
+
+    compare_parser = subparsers.add_parser('compare', help='compare results against a baseline')
+    compare_parser.add_argument('-t', '--threshold', help='percentage slowdown to flag as a regression', type=float, default=10.0)
+    compare_parser.add_argument('-m', '--min-delta', help='ignore changes smaller than this many milliseconds', type=float, default=0.1)
+    compare_parser.add_argument('baseline', help='the baseline results', type=str)
+    compare_parser.add_argument('current', help='the results to check', type=str)
+
+    args = parser.parse_args()
+
+    if args.command == 'run':
+        sys.exit(run(args))
+    else:
+        sys.exit(compare(args))
+
+
+if __name__ == "__main__":
+    main()
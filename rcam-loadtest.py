@@ -0,0 +1,216 @@
+#!/usr/bin/env python3
+import argparse
+import io
+import json
+import multiprocessing as mp
+import os
+import statistics
+import time
+from itertools import cycle
+
+import psutil
+import zmq
+from PIL import Image
+
+from rcam import DropCounter
+from rcam.protocol import PubSubCommands, topic_prefix
+
+
+def subscriber(sub_id, pub_url, prefix, *, rate, hwm, decode, work_ms, duration, start_event, results):
+    """A simulated viewer that receives, optionally decodes, and then does some work with each image."""
+
+    context = zmq.Context()
+    sub_sock = context.socket(zmq.SUB)
+    sub_sock.setsockopt(zmq.RCVHWM, hwm)
+    sub_sock.connect(pub_url)
+    sub_sock.setsockopt(zmq.SUBSCRIBE, prefix + PubSubCommands.METADATA)
+    sub_sock.setsockopt(zmq.SUBSCRIBE, prefix + PubSubCommands.JPEGIMG)
+
+    metadata_topic = prefix + PubSubCommands.METADATA
+    jpeg_topic = prefix + PubSubCommands.JPEGIMG
+
+    frames = 0
+    nbytes = 0
+    drops = DropCounter()
+    latencies = []
+    publish_time = None
+
+    min_interval = 1.0 / rate if rate > 0 else 0.0
+
+    start_event.wait()
+    start = time.monotonic()
+    end = start + duration
+    next_time = start
+
+    while (now := time.monotonic()) < end:
+        # a slow reader only gets back to the socket once it's ready for the next image
+        if now < next_time:
+            time.sleep(min(next_time, end) - now)
+            continue
+
+        if sub_sock.poll(timeout=100, flags=zmq.POLLIN) == 0:
+            continue
+
+        tag, idx, data = sub_sock.recv_multipart()
+        idx = int(idx.decode('utf-8'))
+        if tag == metadata_topic:
+            metadata = json.loads(data.decode('utf-8'))
+            publish_time = metadata.get('PublishTime', None)
+            drops.seen(idx, metadata)
+            continue
+        if tag != jpeg_topic:
+            continue
+
+        recv_time = time.time()
+        drops.seen(idx)
+        drops.deliver()
+        frames += 1
+        nbytes += len(data)
+
+        if publish_time is not None:
+            latencies.append(recv_time - publish_time)
+        publish_time = None
+
+        if decode:
+            Image.open(io.BytesIO(data)).load()
+        if work_ms > 0:
+            time.sleep(work_ms / 1000.0)
+
+        next_time += min_interval
+        next_time = max(next_time, time.monotonic() - min_interval)
+
+    elapsed = time.monotonic() - start
+    context.destroy(linger=0)
+
+    results.put({
+        'id': sub_id,
+        'rate': rate,
+        'hwm': hwm,
+        'decode': decode,
+        'work_ms': work_ms,
+        'frames': frames,
+        'bytes': nbytes,
+        'drops': drops.counts(),
+        'elapsed': elapsed,
+        'latencies': latencies,
+    })
+
+
+def find_server(pid):
+    if pid is not None:
+        return psutil.Process(pid)
+
+    # the script is the first argument to python, or the command itself if run directly
+    for proc in psutil.process_iter(['cmdline']):
+        scripts = [os.path.basename(arg) for arg in (proc.info['cmdline'] or [])[:2]]
+        if 'rcam-server.py' in scripts or 'rcam-replay.py' in scripts:
+            if scripts[0] in ('rcam-server.py', 'rcam-replay.py') or scripts[0].startswith('python'):
+                return proc
+
+    return None
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100.0))]
+
+
+def report(results, server_cpu):
+    # the clocks on the server and this machine probably don't agree, so latency is
+    #   reported relative to the best any subscriber saw
+    all_latencies = [l for r in results for l in r['latencies']]
+    base = min(all_latencies) if all_latencies else 0.0
+
+    print()
+    print(" sub  rate  hwm decode work_ms |    fps  server%   lost%    MB/s  lat_ms p95_ms")
+    print("---------------------------------+--------------------------------------------------")
+
+    for r in sorted(results, key=lambda r: r['id']):
+        fps = r['frames'] / r['elapsed'] if r['elapsed'] > 0 else 0.0
+        # frames the server didn't publish, and frames published that never arrived
+        drops = r['drops']
+        captured = max(drops['captured'], 1)
+        server = 100.0 * drops['server'] / captured
+        lost = 100.0 * drops['transport'] / captured
+        mbps = r['bytes'] / r['elapsed'] / 1e6 if r['elapsed'] > 0 else 0.0
+
+        lat = p95 = float('nan')
+        if r['latencies']:
+            lat = (statistics.median(r['latencies']) - base) * 1000
+            p95 = (percentile(r['latencies'], 95) - base) * 1000
+
+        rate = f"{r['rate']:g}" if r['rate'] > 0 else "max"
+        decode = "yes" if r['decode'] else "no"
+
+        print(f"{r['id']:4d} {rate:>5} {r['hwm']:4d} {decode:>6} {r['work_ms']:7g} | {fps:6.1f} {server:7.1f}% {lost:6.1f}% {mbps:7.2f} {lat:7.1f} {p95:6.1f}")
+
+    if server_cpu is not None:
+        print()
+        print(f"server cpu: mean {statistics.fmean(server_cpu):.1f}%, max {max(server_cpu):.1f}% (100% is one core)")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-n', '--subscribers', help='number of subscribers to run', type=int, default=5)
+    parser.add_argument('-t', '--duration', help='seconds to run for', type=float, default=20.0)
+    parser.add_argument('-r', '--rate', help='maximum fps each subscriber reads at, 0 for as fast as possible (cycled over the subscribers)', type=float, nargs='+', default=[0])
+    parser.add_argument('--hwm', help='receive high water mark (cycled over the subscribers)', type=int, nargs='+', default=[2])
+    parser.add_argument('--work-ms', help='milliseconds of work per image after decoding (cycled over the subscribers)', type=float, nargs='+', default=[0])
+    parser.add_argument('--no-decode', help="don't decode the jpeg images", dest='decode', action='store_false')
+    parser.add_argument('-c', '--camera', help='the camera to subscribe to on a multi-camera server', type=int, default=None)
+    parser.add_argument('--server-pid', help='the server process to monitor, if it is on this machine', type=int, default=None)
+    parser.add_argument('api_url', help='the server api url, eg tcp://192.168.1.37:8089', type=str)
+    args = parser.parse_args()
+
+    # the pub socket is always on the port after the api socket
+    addr, port = args.api_url.rsplit(':', 1)
+    pub_url = f"{addr}:{int(port)+1}"
+    prefix = b'' if args.camera is None else topic_prefix(args.camera)
+
+    start_event = mp.Event()
+    results = mp.Queue()
+
+    procs = []
+    settings = zip(range(args.subscribers), cycle(args.rate), cycle(args.hwm), cycle(args.work_ms))
+    for sub_id, rate, hwm, work_ms in settings:
+        kwargs = {
+            'rate': rate,
+            'hwm': hwm,
+            'decode': args.decode,
+            'work_ms': work_ms,
+            'duration': args.duration,
+            'start_event': start_event,
+            'results': results,
+        }
+        proc = mp.Process(target=subscriber, args=(sub_id, pub_url, prefix), kwargs=kwargs, daemon=True)
+        proc.start()
+        procs.append(proc)
+
+    server = find_server(args.server_pid)
+    if server is None:
+        print("server process not found, not measuring server cpu")
+    else:
+        server.cpu_percent()
+
+    # give the subscribers time to connect before they start counting
+    time.sleep(1.0)
+    print(f"running {args.subscribers} subscribers against {pub_url} for {args.duration}s")
+    start_event.set()
+
+    server_cpu = None
+    if server is not None:
+        server_cpu = []
+        end = time.monotonic() + args.duration
+        while time.monotonic() < end:
+            time.sleep(1.0)
+            server_cpu.append(server.cpu_percent())
+
+    collected = [results.get() for _ in procs]
+    for proc in procs:
+        proc.join()
+
+    report(collected, server_cpu)
+
+
+if __name__ == "__main__":
+    main()
@@ -5,6 +5,8 @@ import os
 import re
 import time
 import json
+from concurrent import futures
+from concurrent.futures import ProcessPoolExecutor
 from itertools import islice
 from datetime import datetime
 import piexif
@@ -13,51 +15,153 @@ import zmq
 from PIL import Image
 import numpy as np
 
-from rcam import RCamClient
-from rcam.server import PubSubCommands
+from rcam import RCamClient, DropCounter, rgbimg
+from rcam.protocol import PubSubCommands, topic_prefix
 
 
-def connect(zmq_context, url):
-    # connect to the server
+def subscribe(zmq_context, url, topics):
+    # connect to the server. this is done up front so nothing is missed
+    #   if a command is sent before the pipeline starts running
     sub_sock = zmq_context.socket(zmq.SUB)
-    sub_sock.set_hwm(2)
+    # only limit the receive side, the subscriptions are sent as messages
+    #   and any past the send limit are dropped
+    sub_sock.setsockopt(zmq.RCVHWM, 2)
     sub_sock.connect(url)
-    sub_sock.setsockopt(zmq.SUBSCRIBE, b'')
+    for topic in topics:
+        sub_sock.setsockopt(zmq.SUBSCRIBE, topic)
+    
+    return sub_sock
+
+
+def connect(sub_sock, prefix=b'', *, drops, metadata_tag=PubSubCommands.METADATA, image_tag=PubSubCommands.JPEGIMG, timeout=None):
 
     metadata = None
 
     while True:
-        mask = sub_sock.poll(flags=zmq.POLLIN)
+        # with a timeout, give up if nothing more arrives
+        mask = sub_sock.poll(timeout=timeout, flags=zmq.POLLIN)
         if mask == 0:
+            if timeout is not None:
+                print(f"nothing received for {timeout/1000:g}s, stopping")
+                return
             continue
         
-        tag, idx, data = sub_sock.recv_multipart()
+        # rgb images have a header part before the data
+        tag, idx, *data = sub_sock.recv_multipart()
 
+        tag = tag[len(prefix):]
         idx = int(idx.decode('utf-8'))
 
-        if tag == PubSubCommands.METADATA:
-            metadata = json.loads(data.decode('utf-8'))
+        if tag == metadata_tag:
+            metadata = json.loads(data[0].decode('utf-8'))
+            drops.seen(idx, metadata)
+            continue
+        
+        drops.seen(idx)
+        if metadata is None:
+            drops.drop('no metadata')
         
-        elif metadata is not None and tag == PubSubCommands.JPEGIMG:
-            image_id = f'img-{idx:04d}'
-            
-            jpeg = io.BytesIO(data)
-            image = np.array(Image.open(jpeg))
-            
+        elif tag == image_tag or tag == PubSubCommands.RGBIMG:
+            # the image is decoded by the encoders, so receiving doesn't wait on it
             item = {
                 'idx': idx,
-                'image': image,
+                'tag': tag,
+                'data': data,
                 'metadata': metadata
             }
             yield item
+
+
+def connect_stills(sub_sock, prefix=b'', *, drops, timeout=None):
+    
+    # the stills that didn't arrive in time
+    missing = 0
+    
+    while True:
+        # with a timeout, pass on None so the still is asked for again
+        mask = sub_sock.poll(timeout=timeout, flags=zmq.POLLIN)
+        if mask == 0:
+            if timeout is not None:
+                print(f"no still received for {timeout/1000:g}s, asking again")
+                missing += 1
+                yield None
+            continue
+        
+        # the metadata, the jpeg, and the raw header and data if there are any
+        tag, idx, metajs, jpeg, *raw = sub_sock.recv_multipart()
+        
+        idx = int(idx.decode('utf-8'))
+        metadata = json.loads(metajs.decode('utf-8'))
+        
+        # stills the server took and were lost on the way show as a gap in the indexes,
+        #   the rest of the missing ones were never taken
+        lost = 0 if drops.last_idx is None else max(0, idx - drops.last_idx - 1)
+        if missing > lost:
+            drops.drop('timeout', missing - lost)
+        missing = 0
+        
+        drops.seen(idx, metadata)
+        
+        item = {
+            'idx': idx,
+            'tag': tag[len(prefix):],
+            'data': [jpeg],
+            'metadata': metadata
+        }
+        if len(raw):
+            item['raw'] = raw
+        yield item
+
+
+def burst_frames(pipe, requested):
+    """Pass on the frames of a burst, stopping after its last frame."""
     
-    sub_sock.disconnect(self.pub_url)
+    for item in pipe:
+        metadata = item['metadata']
+        
+        # the server caps the number of frames in a burst
+        count = metadata['BurstCount']
+        if requested is not None and count < requested:
+            print(f"the server is capturing {count} of the {requested} frames asked for")
+        requested = None
+        
+        yield item
+        
+        # any frames lost on the way are counted as dropped
+        if metadata['BurstIndex'] + 1 >= count:
+            return
+
+
+def request_stills(pipe, client, *, interval, raw):
+    """Ask for a still, and for the next one once the last has arrived and the interval is up.
+    
+    A still that doesn't arrive in time is asked for again.
+    """
+    
+    # give the subscription time to reach the server, or the first still is missed
+    time.sleep(0.5)
+    
+    next_time = time.monotonic()
+    client.still(raw)
+    
+    for item in pipe:
+        if item is None:
+            next_time = time.monotonic()
+            client.still(raw)
+            continue
+        
+        yield item
+        
+        next_time = max(next_time + interval, time.monotonic())
+        time.sleep(max(0.0, next_time - time.monotonic()))
+        client.still(raw)
 
 
-def drop(pipe, drop):
+def drop(pipe, drop, *, drops):
     start = 0
     for item in pipe:
         if item['idx'] - start < drop:
+            drops.drop('skipped')
             continue
         start = item['idx']
         
@@ -89,50 +193,125 @@ def generate_exif(pipe):
         yield item
 
 
-def save_metadata(pipe, save_dir):
-    for item in pipe:
-        idx = item['idx']
-        metadata = item['metadata'].copy()
-        
-        # don't save any stats for the camera
-        for k in list(metadata.keys()):
-            if k.endswith('StatsOutput'):
-                del metadata[k]
-        
-        md_path = os.path.join(save_dir, f"img-{idx:04d}.json")
-        print(f"saving to {md_path}")
-        
-        with open(md_path, "w") as f:
-            print(json.dumps(metadata, sort_keys=True, indent=2), file=f)
+def decode_image(tag, data):
+    if tag == PubSubCommands.RGBIMG:
+        return rgbimg.decode(*data)
+    return np.array(Image.open(io.BytesIO(data[0])))
 
-        yield item
 
+def write_frame(save_dir, idx, tag, data, metadata, exif, raw, *, format, level):
+    """Decode a frame and write it and its metadata to disk. This runs in the encoder processes."""
+    
+    # don't save any stats for the camera
+    metadata = { k: v for k, v in metadata.items() if not k.endswith('StatsOutput') }
+    
+    md_path = os.path.join(save_dir, f"img-{idx:04d}.json")
+    with open(md_path, "w") as f:
+        print(json.dumps(metadata, sort_keys=True, indent=2), file=f)
+    
+    options = {}
+    if format == 'png':
+        options['compress_level'] = level
+    if exif is not None:
+        options['exif'] = exif
+    
+    img_path = os.path.join(save_dir, f"img-{idx:04d}.{format}")
+    image = Image.fromarray(decode_image(tag, data))
+    image.save(img_path, **options)
+    
+    # the raw bayer image is saved as a 16 bit greyscale image
+    if raw is not None:
+        raw_path = os.path.join(save_dir, f"img-{idx:04d}-raw.{format}")
+        raw_options = { 'compress_level': level } if format == 'png' else {}
+        Image.fromarray(rgbimg.decode(*raw)).save(raw_path, **raw_options)
+    
+    return img_path
 
-def save_image(pipe, outdir, *, format='png'):
-    for item in pipe:
+
+class Encoders:
+    """A pool of processes that decode, encode and write the frames, so receiving never waits on them.
+    
+    Only a bounded number of frames are queued for the encoders. When they fall behind, frames are
+    dropped as they arrive, rather than the subscription dropping whatever it likes while the
+    receiver is busy.
+    """
+    
+    def __init__(self, save_dir, *, drops, workers=2, max_pending=4, format='png', level=1):
+        self.save_dir = save_dir
+        self.drops = drops
+        self.max_pending = max_pending
+        self.format = format
+        self.level = level
+        
+        self.pool = ProcessPoolExecutor(max_workers=workers)
+        self.pending = []
+        self.dropping = 0
+    
+    def submit(self, item):
+        """Queue a frame to be written, returning False if it was dropped."""
+        
+        self.reap()
+        
         idx = item['idx']
+        if len(self.pending) >= self.max_pending:
+            if self.dropping == 0:
+                print(f"encoders behind with {len(self.pending)} frames queued, dropping frames from {idx}")
+            self.dropping += 1
+            self.drops.drop('backlog')
+            return False
+        
+        if self.dropping > 0:
+            print(f"encoders caught up, dropped {self.dropping} frames")
+            self.dropping = 0
+        
+        future = self.pool.submit(
+            write_frame, self.save_dir, idx, item['tag'], item['data'], item['metadata'], item.get('exif', None), item.get('raw', None),
+            format=self.format, level=self.level
+        )
+        self.pending.append(future)
+        return True
+    
+    def reap(self, wait=False):
+        if wait:
+            futures.wait(self.pending)
         
-        image = item['image']
-        exif = item.get('exif', None)
+        for future in [f for f in self.pending if f.done()]:
+            self.pending.remove(future)
+            img_path = future.result()
+            self.drops.deliver()
+            print(f"saved {img_path}, {len(self.pending)} queued")
+    
+    def close(self):
+        self.reap(wait=True)
+        self.pool.shutdown()
 
-        img_path = os.path.join(outdir, f"img-{idx:04d}.{format}")
 
-        print(f"saving to {img_path}")
-        image = Image.fromarray(image)
-        image.save(img_path, quality=95, exif=exif)
+def save_frames(pipe, encoders):
+    for item in pipe:
+        if encoders.submit(item):
+            yield item
 
-        yield item
 
-    
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument('-n', '--num-images', help='number of images to capture', type=int, default=10)
     parser.add_argument('-d', '--drop', help='images to drop between captures (approx)', type=int, default=10)
+    parser.add_argument('-b', '--burst', help='capture a burst of this many frames at the full sensor rate', type=int, default=0)
+    parser.add_argument('--bracket', help='comma separated exposure times in microseconds to cycle through in a burst', type=str, default=None)
+    parser.add_argument('-t', '--timeout', help='seconds to wait for the next burst frame before giving up, or for a still before asking again', type=float, default=30.0)
+    parser.add_argument('-s', '--stills', help='capture full resolution stills on request, leaving the stream as it is', action='store_true')
+    parser.add_argument('-i', '--interval', help='seconds between stills', type=float, default=0.0)
+    parser.add_argument('--raw', help='save the raw image with each still', action='store_true')
+    parser.add_argument('-c', '--camera', help='the camera to record on a multi-camera server', type=int, default=None)
+    parser.add_argument('-f', '--format', help='the image file format', choices=['png', 'tiff'], default='png')
+    parser.add_argument('-l', '--png-level', help='png compression level, from 0 for none to 9 for the smallest and slowest', type=int, choices=range(10), default=1)
+    parser.add_argument('-e', '--encoders', help='number of encoder processes', type=int, default=2)
+    parser.add_argument('-q', '--queue', help='frames that can wait for an encoder before frames are dropped (default: twice the encoders)', type=int, default=0)
     parser.add_argument('save_dir', help='directory to save images to', type=str)
     parser.add_argument('api_url', help='the api url to connect to', type=str)
     args = parser.parse_args()
     
-    # derive the publish url from the api url
+    # derive the publish urls from the api url
     tcp_re = re.compile("^tcp://(?P<address>.+?):(?P<port>\d+)$")
     mo = tcp_re.match(args.api_url)
     if mo is None:
@@ -141,25 +320,61 @@ def main():
     port = int(mo['port'])
 
     pub_url = f"tcp://{address}:{port+1}"
+    side_url = f"tcp://{address}:{port+2}"
     
-    # create an api client and make sure no cropping or scaling is happening
+    # create an api client and make sure no cropping or scaling is happening. bursts
+    #   and stills are always full size, so the stream is left alone
     zmq_context = zmq.Context()
-    client = RCamClient(zmq_context, args.api_url)
-    client.fit_none()
+    client = RCamClient(zmq_context, args.api_url, args.camera)
+    if args.burst == 0 and not args.stills:
+        client.fit_none()
     
     # prepare the output directory
     args.save_dir = os.path.join(args.save_dir, f"{int(time.time())}")
     os.makedirs(args.save_dir)
     
     # build the pipeline
-    pipe = connect(zmq_context, pub_url)
-    pipe = drop(pipe, args.drop)
+    prefix = b'' if args.camera is None else topic_prefix(args.camera)
+    drops = DropCounter()
+    
+    if args.burst > 0:
+        # the burst frames are sent once they've all been captured
+        metadata_tag, image_tag = PubSubCommands.BURST_METADATA, PubSubCommands.BURST_JPEGIMG
+        sub_sock = subscribe(zmq_context, side_url, [prefix + metadata_tag, prefix + image_tag])
+        
+        exposures = None if args.bracket is None else [int(e) for e in args.bracket.split(',')]
+        client.burst(args.burst, exposures)
+        
+        pipe = connect(sub_sock, prefix, drops=drops, metadata_tag=metadata_tag, image_tag=image_tag, timeout=int(args.timeout * 1000))
+        pipe = burst_frames(pipe, args.burst)
+        args.num_images = args.burst
+    
+    elif args.stills:
+        sub_sock = subscribe(zmq_context, side_url, [prefix + PubSubCommands.STILL])
+        pipe = connect_stills(sub_sock, prefix, drops=drops, timeout=int(args.timeout * 1000))
+        pipe = request_stills(pipe, client, interval=args.interval, raw=args.raw)
+    
+    else:
+        topics = [PubSubCommands.METADATA, PubSubCommands.JPEGIMG, PubSubCommands.RGBIMG]
+        sub_sock = subscribe(zmq_context, pub_url, [prefix + topic for topic in topics])
+        pipe = connect(sub_sock, prefix, drops=drops)
+        pipe = drop(pipe, args.drop, drops=drops)
+    
+    # a burst is sent once and can't be caught again, so all its frames are queued
+    max_pending = args.queue if args.queue > 0 else 2 * args.encoders
+    if args.burst > 0:
+        max_pending = max(max_pending, args.burst)
+    
+    encoders = Encoders(args.save_dir, drops=drops, workers=args.encoders, max_pending=max_pending, format=args.format, level=args.png_level)
+    
     pipe = generate_exif(pipe)
-    pipe = save_metadata(pipe, args.save_dir)
-    pipe = save_image(pipe, args.save_dir)
+    pipe = save_frames(pipe, encoders)
     
     for item in islice(pipe, args.num_images):
         pass
+    
+    encoders.close()
+    print(f"frames: {drops.summary()}")
 
 
 if __name__ == "__main__":
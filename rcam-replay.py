@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+import argparse
+import uuid
+import zmq
+
+import rcam
+from rcam.server import ApiServer, ReplayServer
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-p', '--api-port', help='port to bind api to', type=int, default=8089)
+    parser.add_argument('-f', '--fps', help='the frame rate to replay at (0 for the recorded rate)', type=float, default=0)
+    parser.add_argument('--encoding', help='send images as jpeg, as jpeg tiles of the changes between full jpegs, or as lossless rgb either uncompressed or compressed with lz4 or zstd', choices=['jpeg', 'tiles', 'rgb', 'lz4', 'zstd'], default='jpeg')
+    parser.add_argument('--tile-size', help='with tiles encoding, the size of the tiles in pixels', type=int, default=128)
+    parser.add_argument('--refresh', help='with tiles encoding, send a full image this often in seconds', type=float, default=2.0)
+    parser.add_argument('--motion-threshold', help='only send frames that differ from the last one sent by this many grey levels on average (0 to send every frame)', type=float, default=0)
+    parser.add_argument('--heartbeat', help='with --motion-threshold, send a frame at least this often in seconds', type=float, default=5.0)
+    parser.add_argument('--once', help="stop at the end of the recording instead of looping", dest='loop', action='store_false')
+    parser.add_argument('replay_dir', help='directory of images, with optional json metadata sidecars', type=str)
+    args = parser.parse_args()
+    
+    api_url = f"tcp://0.0.0.0:{args.api_port}"
+    pub_url = f"tcp://0.0.0.0:{args.api_port+1}"
+    
+    urls = rcam.connect_urls(api_url)
+    for u in urls:
+        print(f"listening at {u}")
+    
+    context = zmq.Context()
+    svr_sockname = str(uuid.uuid4())
+    
+    # there's no camera, so the exposure commands have nothing to adjust
+    api_svr = ApiServer(context, api_url, svr_sockname, min_ag=0, max_ag=0, min_et=0, max_et=0)
+    replay_svr = ReplayServer(context, pub_url, svr_sockname,
+        replay_dir=args.replay_dir,
+        fps=args.fps,
+        loop=args.loop,
+        encoding=args.encoding,
+        tile_size=args.tile_size,
+        refresh=args.refresh,
+        motion_threshold=args.motion_threshold,
+        heartbeat=args.heartbeat
+    )
+    replay_svr.start()
+    api_svr.start()
+    
+    try:
+        replay_svr.join()
+    except KeyboardInterrupt:
+        replay_svr.over = True
+        replay_svr.join()
+    
+    api_svr.over = True
+    api_svr.join()
+
+
+if __name__ == "__main__":
+    main()
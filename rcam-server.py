@@ -6,40 +6,74 @@ import rcam
 from rcam.server import Server
 
 
+def ladder(text):
+    # steps of fps:scale:quality, separated by commas
+    steps = []
+    for step in text.split(','):
+        fps, scale, quality = step.split(':')
+        steps.append((float(fps), float(scale), int(quality)))
+    return steps
+
+
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument('-p', '--api-port', help='port to bind api to', type=int, default=8089)
-    parser.add_argument('-c', '--camera-id', help='the camera to connect to', type=int, default=0)
+    parser.add_argument('-c', '--camera-id', help='the camera(s) to connect to', dest='camera_ids', type=int, nargs='+', default=[0])
     parser.add_argument('-m', '--mode', help='the camera mode', type=int, default=2)
     parser.add_argument('-f', '--max-fps', help='the maximum fps', type=int, default=0)
+    parser.add_argument('--fps-governor', help='lower the frame rate to what the processing keeps up with', action='store_true')
+    parser.add_argument('--metrics-port', help='serve prometheus metrics over http on this port (0 for none)', type=int, default=0)
+    parser.add_argument('--thermal', help='step the frame rate, scale and jpeg quality down as the Pi heats up', action='store_true')
+    parser.add_argument('--thermal-ladder', help='with --thermal, the steps as fps:scale:quality,... (fps 0 for no limit)', type=ladder, default=None)
     parser.add_argument('-e', '--exposure-time', help='the exposure time in microseconds', type=int, default=0)
     parser.add_argument('-g', '--analogue-gain', help='the analogue gain', type=float, default=0.0)
     parser.add_argument('--hflip', help='flip the image horizontally', action='store_true')
     parser.add_argument('--vflip', help='flip the image vertically', action='store_true')
     parser.add_argument('--preview', help='run the camera preview on attached monitor', action='store_true')
     parser.add_argument('--tuning-file', help='specify a tuning file override', type=str, default=None)
+    parser.add_argument('--no-cache', help="don't use the cached camera capabilities", dest='cache', action='store_false')
+    parser.add_argument('-w', '--workers', help='number of worker processes for image processing (0 to process in the capture thread)', type=int, default=0)
+    parser.add_argument('--isp', help="scale and crop the images for the viewer in the camera's isp instead of the cpu (not with --rl8/--rg8)", action='store_true')
+    parser.add_argument('--shm', help='also pass uncompressed frames to consumers on this machine through shared memory', action='store_true')
+    parser.add_argument('--shm-slots', help='number of frames in the shared memory ring', type=int, default=4)
+    parser.add_argument('--encoding', help='send images as jpeg, as jpeg tiles of the changes between full jpegs, or as lossless rgb either uncompressed or compressed with lz4 or zstd', choices=['jpeg', 'tiles', 'rgb', 'lz4', 'zstd'], default='jpeg')
+    parser.add_argument('--tile-size', help='with tiles encoding, the size of the tiles in pixels', type=int, default=128)
+    parser.add_argument('--refresh', help='with tiles encoding, send a full image this often in seconds', type=float, default=2.0)
+    parser.add_argument('--motion-threshold', help='only send frames that differ from the last one sent by this many grey levels on average (0 to send every frame)', type=float, default=0)
+    parser.add_argument('--heartbeat', help='with --motion-threshold, send a frame at least this often in seconds', type=float, default=5.0)
+    parser.add_argument('--pair-tolerance', help='publish frames from multiple cameras as sets if their timestamps are within this many milliseconds', type=float, default=0)
     group = parser.add_mutually_exclusive_group()
     group.add_argument('--rl8', help='send raw linear 8bit image', action='store_true')
     group.add_argument('--rg8', help='send raw gamma encoded 8bit image', action='store_true')
+    group.add_argument('--yuv', help='capture and process the images as yuv420 instead of rgb', action='store_true')
+    group.add_argument('--luma', help='capture, process and send only the luma (Y) plane', action='store_true')
     args = parser.parse_args()
     
     api_url = f"tcp://0.0.0.0:{args.api_port}"
     pub_url = f"tcp://0.0.0.0:{args.api_port+1}"
+    side_url = f"tcp://0.0.0.0:{args.api_port+2}"
     
     urls = rcam.connect_urls(api_url)
     for u in urls:
         print(f"listening at {u}")
+    if args.metrics_port > 0:
+        print(f"metrics at http://0.0.0.0:{args.metrics_port}/metrics")
+    if args.shm:
+        for camera_id in args.camera_ids:
+            print(f"shared memory frames at {rcam.shm_url(args.api_port, camera_id if len(args.camera_ids) > 1 else None)}")
     
     kwargs = vars(args)
     del kwargs['api_port']
     
-    dtype = 'rl8' if args.rl8 else 'rg8' if args.rg8 else 'rgb'
+    dtype = 'rl8' if args.rl8 else 'rg8' if args.rg8 else 'yuv' if args.yuv else 'y8' if args.luma else 'rgb'
     del kwargs['rl8']
     del kwargs['rg8']
+    del kwargs['yuv']
+    del kwargs['luma']
     kwargs['dtype'] = dtype
         
     context = zmq.Context()
-    svr = Server(context, api_url, pub_url, **kwargs)
+    svr = Server(context, api_url, pub_url, side_url, **kwargs)
     svr.start()
     
     try:
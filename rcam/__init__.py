@@ -1,3 +1,20 @@
+from .drops import DropCounter
+from .protocol import ApiCommands, PubSubCommands, topic_prefix, shm_url
 
-from .client import RCamClient
-from .connect_urls import connect_urls
+
+# the client needs pyzmq, connect_urls needs psutil and the shared memory client
+#   needs numpy, so they're only imported when they're used
+_lazy = {
+    'RCamClient': '.client',
+    'connect_urls': '.connect_urls',
+    'ShmSubscriber': '.shm_client',
+}
+
+
+def __getattr__(name):
+    if name in _lazy:
+        import importlib
+        value = getattr(importlib.import_module(_lazy[name], __name__), name)
+        globals()[name] = value
+        return value
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -1,81 +1,122 @@
 import zmq
-from rcam.server import ApiCommands
+from .protocol import ApiCommands, topic_prefix
 
 
 class RCamClient:
     
-    def __init__(self, zmq_context, api_url):
+    def __init__(self, zmq_context, api_url, camera=None):
         self.api_sock = zmq_context.socket(zmq.PUSH)
         self.api_sock.connect(api_url)
+        
+        # address the commands to a single camera on a multi-camera server
+        self.prefix = b'' if camera is None else topic_prefix(camera)
+
+    def send(self, cmd, body=b''):
+        self.api_sock.send_multipart([self.prefix + cmd, body])
 
     def shutdown(self):
-        self.api_sock.send_multipart([ApiCommands.SHUTDOWN, b''])
+        self.send(ApiCommands.SHUTDOWN)
         
     def auto_focus(self, state):
         if state:
-            self.api_sock.send_multipart([ApiCommands.AUTOFOCUS_ENABLE, b''])
+            self.send(ApiCommands.AUTOFOCUS_ENABLE)
         else:
-            self.api_sock.send_multipart([ApiCommands.AUTOFOCUS_DISABLE, b''])
+            self.send(ApiCommands.AUTOFOCUS_DISABLE)
 
     def run_autofocus(self):
-        self.api_sock.send_multipart([ApiCommands.AUTOFOCUS_RUN, b''])
+        self.send(ApiCommands.AUTOFOCUS_RUN)
+    
+    def run_focus_sweep(self):
+        self.send(ApiCommands.AUTOFOCUS_SWEEP)
+
+    def set_focus_roi(self, x, y, w, h):
+        """Set the region used for the focus score, as fractions of the image size."""
+        body = f"{x},{y},{w},{h}".encode('utf-8')
+        self.send(ApiCommands.FOCUS_ROI, body)
     
     def increase_lens_position(self):
-        self.api_sock.send_multipart([ApiCommands.LENS_POSITION_INCREASE, b''])
+        self.send(ApiCommands.LENS_POSITION_INCREASE)
 
     def decrease_lens_position(self):
-        self.api_sock.send_multipart([ApiCommands.LENS_POSITION_DECREASE, b''])
+        self.send(ApiCommands.LENS_POSITION_DECREASE)
 
     def auto_exposure(self, state):
         if state:
-            self.api_sock.send_multipart([ApiCommands.AUTOEXPOSURE_ENABLE, b''])
+            self.send(ApiCommands.AUTOEXPOSURE_ENABLE)
         else:
-            self.api_sock.send_multipart([ApiCommands.AUTOEXPOSURE_DISABLE, b''])
+            self.send(ApiCommands.AUTOEXPOSURE_DISABLE)
 
     def gain_increase(self, locked):
         body = ApiCommands.EXPOSURE_LOCKED if locked else ApiCommands.EXPOSURE_UNLOCKED
-        self.api_sock.send_multipart([ApiCommands.ANALOGUE_GAIN_INCREASE, body])
+        self.send(ApiCommands.ANALOGUE_GAIN_INCREASE, body)
         
     def gain_decrease(self, locked):
         body = ApiCommands.EXPOSURE_LOCKED if locked else ApiCommands.EXPOSURE_UNLOCKED
-        self.api_sock.send_multipart([ApiCommands.ANALOGUE_GAIN_DECREASE, body])
+        self.send(ApiCommands.ANALOGUE_GAIN_DECREASE, body)
 
     def etime_increase(self, locked):
         body = ApiCommands.EXPOSURE_LOCKED if locked else ApiCommands.EXPOSURE_UNLOCKED
-        self.api_sock.send_multipart([ApiCommands.EXPOSURE_TIME_INCREASE, body])
+        self.send(ApiCommands.EXPOSURE_TIME_INCREASE, body)
 
     def etime_decrease(self, locked):
         body = ApiCommands.EXPOSURE_LOCKED if locked else ApiCommands.EXPOSURE_UNLOCKED
-        self.api_sock.send_multipart([ApiCommands.EXPOSURE_TIME_DECREASE, body])
+        self.send(ApiCommands.EXPOSURE_TIME_DECREASE, body)
 
     def auto_whitebalance(self, state):
         if state:
-            self.api_sock.send_multipart([ApiCommands.AUTO_WHITE_BALANCE_ENABLE, b''])
+            self.send(ApiCommands.AUTO_WHITE_BALANCE_ENABLE)
         else:
-            self.api_sock.send_multipart([ApiCommands.AUTO_WHITE_BALANCE_DISABLE, b''])
+            self.send(ApiCommands.AUTO_WHITE_BALANCE_DISABLE)
 
     def red_gain_increase(self):
-        self.api_sock.send_multipart([ApiCommands.RED_GAIN_INCREASE, b''])
+        self.send(ApiCommands.RED_GAIN_INCREASE)
         
     def red_gain_decrease(self):
-        self.api_sock.send_multipart([ApiCommands.RED_GAIN_DECREASE, b''])
+        self.send(ApiCommands.RED_GAIN_DECREASE)
 
     def blue_gain_increase(self):
-        self.api_sock.send_multipart([ApiCommands.BLUE_GAIN_INCREASE, b''])
+        self.send(ApiCommands.BLUE_GAIN_INCREASE)
         
     def blue_gain_decrease(self):
-        self.api_sock.send_multipart([ApiCommands.BLUE_GAIN_DECREASE, b''])
+        self.send(ApiCommands.BLUE_GAIN_DECREASE)
 
     def set_size(self, width, height):
         body = f"{width}x{height}".encode('utf-8')
-        self.api_sock.send_multipart([ApiCommands.SET_SIZE, body])
+        self.send(ApiCommands.SET_SIZE, body)
 
     def fit_none(self):
-        self.api_sock.send_multipart([ApiCommands.FIT_NONE, b''])
+        self.send(ApiCommands.FIT_NONE)
 
     def fit_scaled(self):
-        self.api_sock.send_multipart([ApiCommands.FIT_SCALED, b''])
+        self.send(ApiCommands.FIT_SCALED)
 
     def fit_cropped(self):
-        self.api_sock.send_multipart([ApiCommands.FIT_CROPPED, b''])
-
+        self.send(ApiCommands.FIT_CROPPED)
+
+    def burst(self, count, exposures=None):
+        """Capture count full resolution frames, optionally cycling through exposure times in microseconds."""
+        body = f"{count}"
+        if exposures:
+            body += ":" + ",".join(f"{int(e)}" for e in exposures)
+        self.send(ApiCommands.BURST, body.encode('utf-8'))
+
+    def still(self, raw=False):
+        """Capture one full resolution still at maximum quality, sent on the still topic without changing the stream."""
+        body = "raw" if raw else ""
+        self.send(ApiCommands.STILL, body.encode('utf-8'))
+
+    def reconfigure(self, *, mode=None, dtype=None, hflip=None, vflip=None):
+        """Switch the sensor mode, image type (rgb, rl8, rg8, yuv or y8) or flips without restarting the server."""
+        settings = { 'mode': mode, 'dtype': dtype, 'hflip': hflip, 'vflip': vflip }
+        body = ",".join(f"{k}={int(v) if isinstance(v, bool) else v}" for k, v in settings.items() if v is not None)
+        self.send(ApiCommands.RECONFIGURE, body.encode('utf-8'))
+
+    def set_fps(self, fps):
+        """Set the maximum frame rate, 0 for the sensor's maximum."""
+        self.send(ApiCommands.SET_FPS, f"{fps}".encode('utf-8'))
+
+    def fps_governor(self, state):
+        if state:
+            self.send(ApiCommands.FPS_GOVERNOR_ENABLE)
+        else:
+            self.send(ApiCommands.FPS_GOVERNOR_DISABLE)
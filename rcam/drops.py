@@ -0,0 +1,126 @@
+class DropCounter:
+    """Accounts for every frame the server captured that a client didn't deliver.
+
+    The frame index counts the frames captured, so the frames a client never received
+    are the gaps in the indexes it saw. The server publishes how many frames it has
+    dropped itself in DroppedFrames, and how many the sensor produced that were never
+    captured in SensorDropped, so the rest of the gap was lost on the way, at the
+    publisher's or subscriber's high water mark or on the network. Frames that were
+    received but not used are counted by the client, with the reason.
+    """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.first_idx = None
+        self.last_idx = None
+        self.received = 0
+        self.delivered = 0
+        self.client = {}
+        self.first_metadata = None
+        self.last_metadata = None
+
+    def seen(self, idx, metadata=None):
+        """Note a message for a frame, with the frame's metadata if it has it."""
+
+        # the index going backwards means the server has restarted
+        if self.last_idx is not None and idx < self.last_idx:
+            self.reset()
+
+        if self.first_idx is None:
+            self.first_idx = idx
+        if idx != self.last_idx:
+            self.received += 1
+            self.last_idx = idx
+
+        if metadata is not None:
+            if self.first_metadata is None:
+                self.first_metadata = metadata
+            self.last_metadata = metadata
+
+    def skip(self, idx, reason):
+        """Count the frames before idx since the last one seen as dropped by the client, eg while unsubscribed."""
+
+        if self.last_idx is None or idx <= self.last_idx + 1:
+            return
+
+        skipped = idx - self.last_idx - 1
+        self.received += skipped
+        self.last_idx = idx - 1
+        self.drop(reason, skipped)
+
+    def deliver(self):
+        self.delivered += 1
+
+    def drop(self, reason, count=1):
+        self.client[reason] = self.client.get(reason, 0) + count
+
+    @property
+    def captured(self):
+        return 0 if self.first_idx is None else self.last_idx - self.first_idx + 1
+
+    def _since_first(self, key):
+        if self.first_metadata is None:
+            return 0
+        return max(0, self.last_metadata.get(key, 0) - self.first_metadata.get(key, 0))
+
+    @property
+    def sensor(self):
+        return self._since_first('SensorDropped')
+
+    @property
+    def server(self):
+        return min(self._since_first('DroppedFrames'), self.captured - self.received)
+
+    @property
+    def server_stages(self):
+        if self.first_metadata is None:
+            return {}
+        first = self.first_metadata.get('StageDrops', {})
+        stages = {}
+        for stage, count in self.last_metadata.get('StageDrops', {}).items():
+            if (count := count - first.get(stage, 0)) > 0:
+                stages[stage] = count
+        return stages
+
+    @property
+    def transport(self):
+        return self.captured - self.received - self.server
+
+    def counts(self):
+        return {
+            'captured': self.captured,
+            'delivered': self.delivered,
+            'sensor': self.sensor,
+            'server': self.server,
+            'transport': self.transport,
+            'client': sum(self.client.values()),
+        }
+
+    def summary(self):
+        """A one line account of the frames, eg for a status bar."""
+
+        text = f"delivered {self.delivered}/{self.captured}"
+
+        def reasons(counts):
+            return ", ".join(f"{k} {v}" for k, v in counts.items())
+
+        # without metadata, the server's drops can't be told apart from losses on the way
+        if self.first_metadata is None:
+            text += f", not received {self.captured - self.received}"
+        else:
+            text += f", server {self.server}"
+            if len(stages := self.server_stages):
+                text += f" ({reasons(stages)})"
+            text += f", transport {self.transport}"
+
+        client = sum(self.client.values())
+        text += f", client {client}"
+        if client > 0:
+            text += f" ({reasons(self.client)})"
+
+        if self.sensor > 0:
+            text += f", sensor {self.sensor}"
+
+        return text
@@ -0,0 +1,80 @@
+class ApiCommands:
+    SHUTDOWN = 'shutdown'.encode('utf-8')
+
+    AUTOFOCUS_ENABLE  = "af_enable".encode('utf-8')
+    AUTOFOCUS_DISABLE = "af_disable".encode('utf-8')
+
+    AUTOFOCUS_RUN = "af_run".encode('utf-8')
+    AUTOFOCUS_SWEEP = "af_sweep".encode('utf-8')
+    
+    FOCUS_ROI = "focus_roi".encode('utf-8')
+    
+    LENS_POSITION_INCREASE = "lens_position_increase".encode('utf-8')
+    LENS_POSITION_DECREASE = "lens_position_decrease".encode('utf-8')
+
+    AUTOEXPOSURE_ENABLE  = "ae_enable".encode('utf-8')
+    AUTOEXPOSURE_DISABLE = "ae_disable".encode('utf-8')
+    
+    ANALOGUE_GAIN_INCREASE = "analogue_gain_increase".encode('utf-8')
+    ANALOGUE_GAIN_DECREASE = "analogue_gain_decrease".encode('utf-8')
+    
+    EXPOSURE_TIME_INCREASE = "exposure_time_increase".encode('utf-8')
+    EXPOSURE_TIME_DECREASE = "exposure_time_decrease".encode('utf-8')
+
+    EXPOSURE_LOCKED   = "exposure_locked".encode('utf-8')
+    EXPOSURE_UNLOCKED = "exposure_unlocked".encode('utf-8')
+    
+    AUTO_WHITE_BALANCE_ENABLE  = "awb_enable".encode('utf-8')
+    AUTO_WHITE_BALANCE_DISABLE = "awb_disable".encode('utf-8')
+    
+    RED_GAIN_INCREASE  = "rg_increase".encode('utf-8')
+    RED_GAIN_DECREASE  = "rg_decrease".encode('utf-8')
+    BLUE_GAIN_INCREASE = "bg_increase".encode('utf-8')
+    BLUE_GAIN_DECREASE = "bg_decrease".encode('utf-8')
+    
+    SET_SIZE    = "set_size".encode('utf-8')
+    FIT_NONE    = "fit_none".encode('utf-8')
+    FIT_SCALED  = "fit_scaled".encode('utf-8')
+    FIT_CROPPED = "fit_cropped".encode('utf-8')
+    
+    BURST = "burst".encode('utf-8')
+    STILL = "still".encode('utf-8')
+    
+    RECONFIGURE = "reconfigure".encode('utf-8')
+    
+    SET_FPS = "set_fps".encode('utf-8')
+    FPS_GOVERNOR_ENABLE  = "fps_governor_enable".encode('utf-8')
+    FPS_GOVERNOR_DISABLE = "fps_governor_disable".encode('utf-8')
+
+
+class PubSubCommands:
+    METADATA = "metadata".encode('utf-8')
+    JPEGIMG  = "jpeg".encode('utf-8')
+    RGBIMG   = "rgb".encode('utf-8')
+    TILES    = "tiles".encode('utf-8')
+
+    BURST_METADATA = "burst_metadata".encode('utf-8')
+    BURST_JPEGIMG  = "burst_jpeg".encode('utf-8')
+
+    # a full resolution still in one message: the metadata, the jpeg, then the raw
+    #   image's header and data if it was asked for
+    STILL = "still".encode('utf-8')
+
+    # announces a frame written to the shared memory ring
+    SHMFRAME = "shm_frame".encode('utf-8')
+
+    # prefix for the topics that carry synchronised frames from several cameras
+    PAIR_PREFIX = "pair/".encode('utf-8')
+
+
+def topic_prefix(camera_id):
+    """The prefix for topics and commands addressed to a camera in a multi-camera server."""
+    return f"cam{camera_id}/".encode('utf-8')
+
+
+def shm_url(api_port, camera_id=None):
+    """The ipc url a server on this machine announces its shared memory frames on."""
+    # tempfile pulls in a lot of the standard library, so it's only imported here
+    import tempfile
+    suffix = "" if camera_id is None else f"-cam{camera_id}"
+    return f"ipc://{tempfile.gettempdir()}/rcam-{api_port}{suffix}.shm"
@@ -0,0 +1,59 @@
+import json
+
+import numpy as np
+
+compressions = ('none', 'lz4', 'zstd')
+
+# the compressors are optional, only needed if they're used
+available = ['none']
+
+try:
+    import lz4.frame
+    available.append('lz4')
+except:
+    pass
+
+try:
+    import zstandard
+    available.append('zstd')
+except:
+    pass
+
+
+def encode(image, *, compression='none', level=1):
+    """Encode an image for the rgb topic, returning the header and the data to send.
+
+    The header is json with the shape, dtype and strides needed to rebuild the array.
+    """
+
+    image = np.ascontiguousarray(image)
+    data = image.data
+
+    if compression == 'lz4':
+        data = lz4.frame.compress(data, compression_level=level)
+    elif compression == 'zstd':
+        data = zstandard.ZstdCompressor(level=level).compress(data)
+    elif compression != 'none':
+        raise ValueError(f"unknown compression {compression}")
+
+    header = {
+        'shape': image.shape,
+        'dtype': image.dtype.str,
+        'strides': image.strides,
+        'compression': compression
+    }
+    return json.dumps(header, separators=(',',':')).encode('utf-8'), data
+
+
+def decode(header, data):
+    """Rebuild an image from an rgb topic message. Uncompressed images are a view onto the data."""
+
+    header = json.loads(bytes(header).decode('utf-8'))
+
+    compression = header['compression']
+    if compression == 'lz4':
+        data = lz4.frame.decompress(data)
+    elif compression == 'zstd':
+        data = zstandard.ZstdDecompressor().decompress(data)
+
+    return np.ndarray(header['shape'], dtype=np.dtype(header['dtype']), buffer=data, strides=header['strides'])
@@ -1,55 +1,22 @@
-import uuid
-
-from .api_server import ApiServer
-from .pub_server import PubServer
-
-from .camera import Camera
-from .commands import ApiCommands, PubSubCommands
-
-
-class Server:
-    def __init__(self, context, api_url, pub_url, *, camera_id, mode, max_fps, exposure_time, analogue_gain, hflip, vflip, preview, tuning_file, dtype):
-
-        svr_sockname = str(uuid.uuid4())
-        
-        cam = Camera(
-            camera_id,
-            mode,
-            max_fps=max_fps,
-            vflip=vflip,
-            hflip=hflip,
-            exposure_time=exposure_time,
-            analogue_gain=analogue_gain,
-            preview=preview,
-            tuning_file=tuning_file
-        )
-        if preview:
-            cam.start_preview_()
-            
-        min_ag, max_ag, _ = cam.camera_controls['AnalogueGain']
-        min_et, max_et, _ = cam.camera_controls['ExposureTime']
-
-        self.pub_svr = PubServer(context, pub_url, svr_sockname,
-            camera=cam,
-            ae_enabled=(exposure_time == 0),
-            dtype=dtype
-        )
-        self.api_svr = ApiServer(context, api_url, svr_sockname,
-                min_ag=min_ag,
-                max_ag=max_ag,
-                min_et=min_et,
-                max_et=max_et
-        )
-
-    def start(self):
-        self.pub_svr.start()
-        self.api_svr.start()
-
-    def set_over(self):
-        self.pub_svr.over = True
-        self.api_svr.over = True
-
-    def join(self):
-        self.pub_svr.join()
-        self.api_svr.join()
-
+# the server modules pull in picamera2, numpy, PIL and opencv, so they're only
+#   imported when something from them is used
+_lazy = {
+    'Server': '.server',
+    'ApiServer': '.api_server',
+    'ApiRouter': '.api_router',
+    'PubServer': '.pub_server',
+    'PubProxy': '.pub_proxy',
+    'ReplayServer': '.replay',
+    'Camera': '.camera',
+}
+
+from .commands import ApiCommands, PubSubCommands, topic_prefix, shm_url
+
+
+def __getattr__(name):
+    if name in _lazy:
+        import importlib
+        value = getattr(importlib.import_module(_lazy[name], __name__), name)
+        globals()[name] = value
+        return value
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
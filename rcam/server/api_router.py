@@ -0,0 +1,49 @@
+import threading
+import zmq
+
+from .commands import ApiCommands
+
+
+class ApiRouter(threading.Thread):
+    """Routes the commands from the shared api endpoint to the api server of each camera.
+    
+    Commands with a camera address prefix go to that camera only, commands without one
+    go to all the cameras.
+    """
+    
+    def __init__(self, context, api_url, camera_urls):
+        super().__init__()
+        self.over = False
+        self.api_sock = context.socket(zmq.PULL)
+        self.api_sock.bind(api_url)
+        
+        self.camera_socks = {}
+        for prefix, camera_url in camera_urls.items():
+            sock = context.socket(zmq.PUSH)
+            sock.connect(camera_url)
+            self.camera_socks[prefix] = sock
+    
+    def run(self):
+        print("api_router: start")
+        
+        while self.over == False:
+            if self.api_sock.poll(timeout=200, flags=zmq.POLLIN) == 0:
+                continue
+            
+            cmd, body = self.api_sock.recv_multipart()
+
+            prefix, sep, bare_cmd = cmd.rpartition(b'/')
+            if len(sep) == 0:
+                for sock in self.camera_socks.values():
+                    sock.send_multipart([cmd, body])
+                
+                if cmd == ApiCommands.SHUTDOWN:
+                    self.over = True
+            
+            elif (sock := self.camera_socks.get(prefix + sep, None)) is not None:
+                sock.send_multipart([bare_cmd, body])
+            
+            else:
+                print(f"api_router: unknown camera address {prefix.decode('utf-8')}")
+
+        print("api_router: finish")
@@ -3,6 +3,7 @@ import threading
 import zmq
 
 from .commands import ApiCommands
+from . import metrics
 
 
 class ApiServer(threading.Thread):
@@ -37,6 +38,8 @@ class ApiServer(threading.Thread):
             ApiCommands.AUTOFOCUS_ENABLE: self.handle_af_enable,
             ApiCommands.AUTOFOCUS_DISABLE: self.handle_af_disable,
             ApiCommands.AUTOFOCUS_RUN: self.handle_af_run,
+            ApiCommands.AUTOFOCUS_SWEEP: self.handle_af_sweep,
+            ApiCommands.FOCUS_ROI: self.handle_focus_roi,
             ApiCommands.LENS_POSITION_INCREASE: self.handle_lp_increase,
             ApiCommands.LENS_POSITION_DECREASE: self.handle_lp_decrease,
             ApiCommands.AUTOEXPOSURE_ENABLE: self.handle_ae_enable,
@@ -55,6 +58,12 @@ class ApiServer(threading.Thread):
             ApiCommands.FIT_NONE: self.handle_fit_none,
             ApiCommands.FIT_SCALED: self.handle_fit_scaled,
             ApiCommands.FIT_CROPPED: self.handle_fit_cropped,
+            ApiCommands.BURST: self.handle_burst,
+            ApiCommands.STILL: self.handle_still,
+            ApiCommands.RECONFIGURE: self.handle_reconfigure,
+            ApiCommands.SET_FPS: self.handle_set_fps,
+            ApiCommands.FPS_GOVERNOR_ENABLE: self.handle_fps_governor_enable,
+            ApiCommands.FPS_GOVERNOR_DISABLE: self.handle_fps_governor_disable,
         }
         
     def run(self):
@@ -73,7 +82,11 @@ class ApiServer(threading.Thread):
 
     def handle_api_sock(self):
         cmd, body = self.api_sock.recv_multipart()
+        
+        # strip any camera address, the router has already delivered it to the right place
+        cmd = cmd.rpartition(b'/')[2]
         self.api_handlers[cmd](body)
+        metrics.api_commands.inc(command=cmd.decode('utf-8'))
     
     def handle_svr_sock(self):
         updates = self.svr_sock.recv_pyobj()
@@ -108,6 +121,20 @@ class ApiServer(threading.Thread):
         }
         self.svr_sock.send_pyobj(controls)
 
+    def handle_af_sweep(self, body):
+        controls = {
+            'AfSweep': True
+        }
+        self.svr_sock.send_pyobj(controls)
+
+    def handle_focus_roi(self, body):
+        body = body.decode('utf-8')
+        x, y, w, h = [float(v) for v in body.split(',')]
+        controls = {
+            'FocusRoi': (x, y, w, h)
+        }
+        self.svr_sock.send_pyobj(controls)
+
     def handle_lp_increase(self, body):
         if self.lens_position is None:
             return
@@ -269,3 +296,58 @@ class ApiServer(threading.Thread):
             'FitMode': 'cropped'
         }
         self.svr_sock.send_pyobj(controls)
+
+    def handle_burst(self, body):
+        # the body is the frame count, optionally followed by exposure times to cycle through
+        body = body.decode('utf-8')
+        count, _, exposures = body.partition(':')
+        exposures = [int(e) for e in exposures.split(',') if len(e)]
+        controls = {
+            'Burst': (int(count), exposures)
+        }
+        self.svr_sock.send_pyobj(controls)
+
+    def handle_still(self, body):
+        # the body is 'raw' to send the raw image as well
+        controls = {
+            'Still': { 'Raw': body.decode('utf-8') == 'raw' }
+        }
+        self.svr_sock.send_pyobj(controls)
+
+    def handle_reconfigure(self, body):
+        # the body is a list of settings, eg 'mode=1,dtype=rl8,hflip=1'
+        body = body.decode('utf-8')
+        settings = dict(kv.split('=', 1) for kv in body.split(',') if len(kv))
+        
+        reconfigure = {}
+        if 'mode' in settings:
+            reconfigure['Mode'] = int(settings['mode'])
+        if settings.get('dtype', None) in ('rgb', 'rl8', 'rg8', 'yuv', 'y8'):
+            reconfigure['DType'] = settings['dtype']
+        if 'hflip' in settings:
+            reconfigure['HFlip'] = settings['hflip'] == '1'
+        if 'vflip' in settings:
+            reconfigure['VFlip'] = settings['vflip'] == '1'
+        
+        controls = {
+            'Reconfigure': reconfigure
+        }
+        self.svr_sock.send_pyobj(controls)
+
+    def handle_set_fps(self, body):
+        controls = {
+            'MaxFps': max(0.0, float(body.decode('utf-8')))
+        }
+        self.svr_sock.send_pyobj(controls)
+
+    def handle_fps_governor_enable(self, body):
+        controls = {
+            'FpsGovernor': True
+        }
+        self.svr_sock.send_pyobj(controls)
+
+    def handle_fps_governor_disable(self, body):
+        controls = {
+            'FpsGovernor': False
+        }
+        self.svr_sock.send_pyobj(controls)
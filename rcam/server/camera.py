@@ -4,6 +4,8 @@ os.environ['LIBCAMERA_LOG_LEVELS'] = "*:ERROR"
 import time
 import types
 
+from . import camera_cache
+
 # so we can import the wider package on non-raspberrypi machines
 try:
     from picamera2 import Picamera2, Preview
@@ -23,14 +25,90 @@ def Camera(
     exposure_time=0, 
     analogue_gain=0.0,
     tuning_file=None,
+    cache=True,
+    isp=False,
+    yuv=False,
 ):
 
+    # the sensor modes and aligned configurations are slow to find out, so they're
+    #   cached between runs
+    cache_key = None
+    cache_data = None
+    cache_changed = False
+    if cache:
+        cache_key = camera_cache.cache_key(camid, tuning_file)
+        cache_data = camera_cache.load(cache_key)
+
     # check for tuning file override
     tuning = None if tuning_file is None else Picamera2.load_tuning_file(tuning_file)
 
     cam = Picamera2(camid, tuning=tuning)
+    
+    if cache_data is None:
+        cache_data = camera_cache.probe(cam)
+        cache_changed = True
+
+    # build and align the configuration for every mode up front, so switching between
+    #   them only needs the camera restarting
+    isp = isp and not preview
+    settings = {
+        'preview': preview,
+        'isp': isp,
+        'exposure_time': exposure_time,
+        'analogue_gain': analogue_gain
+    }
+    
+    configs = {}
+    for m in range(len(cache_data['sensor_modes'])):
+        configs[(m, yuv)], changed = build_config(cam, cache_data, m, yuv=yuv, **settings)
+        cache_changed = cache_changed or changed
+    
+    cam.configure(with_transform(configs[(mode, yuv)], hflip, vflip))
+    
+    if cache and cache_changed:
+        camera_cache.save(cache_key, cache_data)
+    
+    if max_fps > 0:
+        minfd, maxfd, _ = cam.camera_controls['FrameDurationLimits']
+        minfd = max(minfd, int(1000000/max_fps))
+        fd_controls = {
+            'FrameDurationLimits': (minfd, maxfd)
+        }
+        cam.set_controls(fd_controls)
+    
+    # add some helper methods
+    cam.start_preview_ = types.MethodType(start_preview_, cam)
+    
+    cam.isp_ = isp
+    cam.sensor_mode_ = cache_data['sensor_modes'][mode]
+    # the operators that need the full size image, eg for a burst
+    cam.full_res_ = set()
+    cam.set_isp_fit_ = types.MethodType(set_isp_fit_, cam)
+    
+    cam.mode_ = mode
+    cam.hflip_ = hflip
+    cam.vflip_ = vflip
+    cam.yuv_ = yuv
+    cam.configs_ = configs
+    cam.config_settings_ = settings
+    cam.cache_key_ = cache_key
+    cam.cache_data_ = cache_data
+    cam.max_framesize_ = max_framesize(cache_data['sensor_modes'])
+    cam.switch_config_ = types.MethodType(switch_config_, cam)
+    
+    cam.wait_for_aelock_ = types.MethodType(wait_for_aelock_, cam)
+
+    cam.enable_auto_ = types.MethodType(enable_auto_, cam)
+    cam.disable_auto_ = types.MethodType(disable_auto_, cam)
+    cam.set_exposure_ = types.MethodType(set_exposure_, cam)
 
-    sensor_mode = cam.sensor_modes[mode]
+    return cam
+
+
+def build_config(cam, cache_data, mode, *, preview, isp, yuv, exposure_time, analogue_gain):
+    """The aligned configuration for a mode, and whether the alignment had to be worked out."""
+    
+    sensor_mode = cache_data['sensor_modes'][mode]
     sensor_format = sensor_mode['unpacked']
     sensor_size = sensor_mode['size']
     sensor_bit_depth = sensor_mode['bit_depth']
@@ -51,7 +129,7 @@ def Camera(
         },
         'main': {
             'size': sensor_size,
-            'format': 'BGR888'  # is actually RGB
+            'format': 'YUV420' if yuv else 'BGR888'  # is actually RGB
         },
         'raw': {
             'size': sensor_size,
@@ -84,32 +162,119 @@ def Camera(
             'size': preview_size
         }
         kwargs['display'] = 'lores'
-
-    if vflip or hflip:
-        kwargs['transform'] = Transform(vflip=vflip, hflip=hflip)
     
+    # the viewer sized images come from the isp's second output. it's resized to
+    #   suit the viewer later, this is just somewhere to start
+    if isp:
+        kwargs['lores'] = {
+            'size': lores_size(sensor_size, (640, 480)),
+            'format': lores_format()
+        }
+
     config = cam.create_still_configuration(**kwargs)
+    
+    config_key = f"still-{mode}-{'preview' if preview else 'isp' if isp else 'nopreview'}{'-yuv' if yuv else ''}"
+    aligned = cache_data['configurations'].get(config_key, None)
+    if aligned is not None:
+        for stream, size in aligned.items():
+            config[stream]['size'] = tuple(size)
+        return config, False
+    
     cam.align_configuration(config)
-    cam.configure(config)
+    aligned = { stream: config[stream]['size'] for stream in ('main', 'lores', 'raw') if config.get(stream, None) is not None }
+    cache_data['configurations'][config_key] = aligned
+    return config, True
+
+
+def with_transform(config, hflip, vflip):
+    # the library fills in the streams when it's configured, so keep the prebuilt ones clean
+    config = { k: dict(v) if isinstance(v, dict) else v for k, v in config.items() }
+    config['transform'] = Transform(vflip=vflip, hflip=hflip)
+    return config
+
+
+def max_framesize(sensor_modes):
+    """The most bytes any mode's rgb or unpacked raw image can take, including row padding."""
+    return max((w + 63) // 64 * 64 * h * 3 for w, h in (m['size'] for m in sensor_modes))
+
+
+def switch_config_(self, *, mode=None, hflip=None, vflip=None, yuv=None):
+    """Switch to the prebuilt configuration for another mode, flip or format.
     
-    if max_fps > 0:
-        minfd, maxfd, _ = cam.camera_controls['FrameDurationLimits']
-        minfd = max(minfd, int(1000000/max_fps))
-        fd_controls = {
-            'FrameDurationLimits': (minfd, maxfd)
-        }
-        cam.set_controls(fd_controls)
+    The controls set so far are kept, apart from those that depend on the mode.
+    Returns False if there was nothing to change.
+    """
     
-    # add some helper methods
-    cam.start_preview_ = types.MethodType(start_preview_, cam)
+    mode = self.mode_ if mode is None else mode
+    hflip = self.hflip_ if hflip is None else hflip
+    vflip = self.vflip_ if vflip is None else vflip
+    yuv = self.yuv_ if yuv is None else yuv
     
-    cam.wait_for_aelock_ = types.MethodType(wait_for_aelock_, cam)
+    sensor_modes = self.cache_data_['sensor_modes']
+    if mode < 0 or mode >= len(sensor_modes):
+        raise ValueError(f"camera has no mode {mode}")
+    
+    if (mode, hflip, vflip, yuv) == (self.mode_, self.hflip_, self.vflip_, self.yuv_):
+        return False
+    
+    # only the current format is prebuilt, the others are built when first asked for
+    if (mode, yuv) not in self.configs_:
+        self.configs_[(mode, yuv)], changed = build_config(self, self.cache_data_, mode, yuv=yuv, **self.config_settings_)
+        if changed and self.cache_key_ is not None:
+            camera_cache.save(self.cache_key_, self.cache_data_)
+    
+    config = with_transform(self.configs_[(mode, yuv)], hflip, vflip)
+    current = { k: v for k, v in self.controls.make_dict().items() if k not in ('ScalerCrop', 'FrameDurationLimits') }
+    config['controls'] = dict(config['controls'], **current)
+    
+    self.stop()
+    self.configure(config)
+    self.start()
+    
+    self.mode_, self.hflip_, self.vflip_, self.yuv_ = mode, hflip, vflip, yuv
+    self.sensor_mode_ = sensor_modes[mode]
+    return True
 
-    cam.enable_auto_ = types.MethodType(enable_auto_, cam)
-    cam.disable_auto_ = types.MethodType(disable_auto_, cam)
-    cam.set_exposure_ = types.MethodType(set_exposure_, cam)
 
-    return cam
+def lores_format():
+    # the pi5 isp can output rgb on its second output, earlier models only yuv
+    try:
+        from picamera2.platform import Platform, get_platform
+        if get_platform() == Platform.PISP:
+            return 'BGR888'
+    except Exception:
+        pass
+    return 'YUV420'
+
+
+def lores_size(image_size, fit_size):
+    """The largest size with the image's aspect ratio that fits, aligned for the isp."""
+    
+    image_w, image_h = image_size
+    fit_w, fit_h = fit_size
+    scale = min(fit_w / image_w, fit_h / image_h, 1.0)
+    
+    # a multiple of 64 wide keeps the yuv rows unpadded
+    width = max(64, int(image_w * scale) // 64 * 64)
+    height = max(2, int(image_h * width / image_w) // 2 * 2)
+    return (width, height)
+
+
+def set_isp_fit_(self, size, scaler_crop):
+    """Set the size of the second output and the region of the sensor it shows."""
+    
+    if tuple(self.camera_config['lores']['size']) == tuple(size):
+        self.set_controls({'ScalerCrop': scaler_crop})
+        return
+    
+    # a new size needs the camera reconfigured. keep all the controls set so far
+    config = self.camera_config.copy()
+    config['lores'] = dict(config['lores'], size=tuple(size))
+    config['controls'] = dict(self.controls.make_dict(), ScalerCrop=scaler_crop)
+    
+    self.stop()
+    self.configure(config)
+    self.start()
 
 
 def start_preview_(self):
@@ -0,0 +1,97 @@
+import os
+import json
+import hashlib
+
+# so we can import the wider package on non-raspberrypi machines
+try:
+    from picamera2 import Picamera2
+    import libcamera
+except:
+    pass
+
+
+def cache_dir():
+    base = os.environ.get('XDG_CACHE_HOME', os.path.join(os.path.expanduser('~'), '.cache'))
+    return os.path.join(base, 'rcam')
+
+
+def libcamera_version():
+    try:
+        return libcamera.CameraManager.singleton().version
+    except Exception:
+        pass
+
+    try:
+        from importlib.metadata import version
+        return f"picamera2-{version('picamera2')}"
+    except Exception:
+        return "unknown"
+
+
+def cache_key(camid, tuning_file=None):
+    """Build the key for a camera from its model, the tuning file and the libcamera version.
+
+    None of these need the camera to be opened.
+    """
+
+    cameras = Picamera2.global_camera_info()
+    camera = next((c for c in cameras if c.get('Num', None) == camid), cameras[camid])
+
+    tuning = "default"
+    if tuning_file is not None:
+        with open(tuning_file, "rb") as f:
+            tuning = hashlib.sha1(f.read()).hexdigest()
+
+    parts = [camera['Model'], camera.get('Id', ''), tuning, libcamera_version()]
+    return hashlib.sha1("|".join(parts).encode('utf-8')).hexdigest()
+
+
+def jsonable(value):
+    """Convert the libcamera types in camera information into something json can store."""
+
+    if isinstance(value, dict):
+        return { str(k): jsonable(v) for k, v in value.items() }
+    if isinstance(value, (list, tuple)):
+        return [jsonable(v) for v in value]
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    return str(value)
+
+
+def load(key):
+    path = os.path.join(cache_dir(), f"{key}.json")
+    try:
+        with open(path) as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return None
+
+    # json turns the tuples into lists
+    for sensor_mode in data.get('sensor_modes', []):
+        for k in ('size', 'crop_limits', 'exposure_limits'):
+            if isinstance(sensor_mode.get(k, None), list):
+                sensor_mode[k] = tuple(sensor_mode[k])
+
+    return data
+
+
+def save(key, data):
+    os.makedirs(cache_dir(), exist_ok=True)
+
+    # write then rename so a reader never sees a partial file
+    path = os.path.join(cache_dir(), f"{key}.json")
+    tmp_path = f"{path}.{os.getpid()}"
+    with open(tmp_path, "w") as f:
+        json.dump(jsonable(data), f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def probe(cam):
+    """Collect the information about an open camera that's expensive to find out."""
+
+    return {
+        'properties': cam.camera_properties.copy(),
+        'controls': cam.camera_controls.copy(),
+        'sensor_modes': list(cam.sensor_modes),
+        'configurations': {}
+    }
@@ -0,0 +1,95 @@
+from multiprocessing import shared_memory, resource_tracker
+import numpy as np
+
+
+def _align(size, alignment=64):
+    return (size + alignment - 1) // alignment * alignment
+
+
+def _attach(name, track):
+    if track:
+        return shared_memory.SharedMemory(name=name)
+
+    # otherwise the resource tracker unlinks the memory when an unrelated process
+    #   that attached to it exits
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        pass
+
+    shm = shared_memory.SharedMemory(name=name)
+    resource_tracker.unregister(shm._name, 'shared_memory')
+    return shm
+
+
+class FrameRing:
+    """A ring of fixed size frame slots in shared memory.
+
+    Each slot has a sequence number alongside it. The writer clears the sequence
+    number before it copies a frame into the slot and sets it once the copy is done,
+    so a reader can check the sequence number before and after it uses a slot to
+    know the frame wasn't overwritten underneath it.
+
+    Processes that weren't started by the owner should attach with track=False.
+    """
+
+    def __init__(self, name=None, *, nslots=0, slot_size=0, track=True):
+        if name is None:
+            header_size = _align(8 * (2 + nslots))
+            slot_size = _align(slot_size)
+            self.shm = shared_memory.SharedMemory(create=True, size=header_size + nslots*slot_size)
+            self.owner = True
+
+            info = np.ndarray((2,), dtype=np.uint64, buffer=self.shm.buf)
+            info[:] = (nslots, slot_size)
+            del info
+        else:
+            self.shm = _attach(name, track)
+            self.owner = False
+
+        info = np.ndarray((2,), dtype=np.uint64, buffer=self.shm.buf)
+        self.nslots, self.slot_size = int(info[0]), int(info[1])
+        del info
+
+        self.header_size = _align(8 * (2 + self.nslots))
+        self.seqs = np.ndarray((self.nslots,), dtype=np.uint64, buffer=self.shm.buf, offset=16)
+        if self.owner:
+            self.seqs[:] = 0
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    def slot(self, seq):
+        return seq % self.nslots
+
+    def array(self, slot, shape, dtype):
+        offset = self.header_size + slot * self.slot_size
+        return np.ndarray(shape, dtype=dtype, buffer=self.shm.buf, offset=offset)
+
+    def write(self, seq, image):
+        """Copy the image into the slot for seq. Sequence numbers must be non-zero."""
+
+        if image.nbytes > self.slot_size:
+            raise ValueError(f"image of {image.nbytes} bytes too big for slot of {self.slot_size} bytes")
+
+        slot = self.slot(seq)
+        self.seqs[slot] = 0
+        np.copyto(self.array(slot, image.shape, image.dtype), image)
+        self.seqs[slot] = seq
+
+        return slot
+
+    def valid(self, slot, seq):
+        return int(self.seqs[slot]) == seq
+
+    def close(self):
+        # the numpy views need to be released before the memory can be closed
+        self.seqs = None
+        try:
+            self.shm.close()
+        except BufferError:
+            # a reader still holds a view of a frame
+            pass
+        if self.owner:
+            self.shm.unlink()
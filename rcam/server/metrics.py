@@ -0,0 +1,198 @@
+import threading
+import time
+from http.server import HTTPServer, BaseHTTPRequestHandler
+
+
+class Metric:
+    """A named metric with a value for each set of label values."""
+
+    kind = 'untyped'
+
+    def __init__(self, name, help):
+        self.name = name
+        self.help = help
+        self.lock = threading.Lock()
+        self.values = {}
+
+    def key(self, labels):
+        return tuple(sorted(labels.items()))
+
+    def samples(self):
+        with self.lock:
+            return [(self.name, dict(k), v) for k, v in self.values.items()]
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    kind = 'gauge'
+
+    def __init__(self, name, help, fn=None):
+        super().__init__(name, help)
+        self.fn = fn
+
+    def set(self, value, **labels):
+        with self.lock:
+            self.values[self.key(labels)] = value
+
+    def samples(self):
+        # gauges with a function are read when they're scraped
+        if self.fn is not None:
+            return [(self.name, {}, self.fn())]
+        return super().samples()
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, help, buckets):
+        super().__init__(name, help)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self.key(labels)
+        with self.lock:
+            counts, total, count = self.values.get(key, ([0] * len(self.buckets), 0.0, 0))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            self.values[key] = (counts, total + value, count + 1)
+
+    def samples(self):
+        samples = []
+        with self.lock:
+            for key, (counts, total, count) in self.values.items():
+                labels = dict(key)
+                for bound, n in zip(self.buckets, counts):
+                    samples.append((f"{self.name}_bucket", dict(labels, le=f"{bound:g}"), n))
+                samples.append((f"{self.name}_bucket", dict(labels, le="+Inf"), count))
+                samples.append((f"{self.name}_sum", labels, total))
+                samples.append((f"{self.name}_count", labels, count))
+        return samples
+
+
+registry = []
+
+
+def register(metric):
+    registry.append(metric)
+    return metric
+
+
+def render():
+    """All the metrics in the prometheus text format."""
+
+    lines = []
+    for metric in registry:
+        lines.append(f"# HELP {metric.name} {metric.help}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        for name, labels, value in metric.samples():
+            if len(labels):
+                label_text = ",".join(f'{k}="{v}"' for k, v in labels.items())
+                name = f"{name}{{{label_text}}}"
+            lines.append(f"{name} {value!r}" if isinstance(value, float) else f"{name} {value}")
+    return "\n".join(lines) + "\n"
+
+
+def process_rss():
+    import psutil
+    return psutil.Process().memory_info().rss
+
+
+def process_cpu():
+    import psutil
+    times = psutil.Process().cpu_times()
+    return times.user + times.system
+
+
+latency_buckets = (0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1.0)
+
+frames_captured = register(Counter('rcam_frames_captured_total', 'frames captured from the camera'))
+frames_processed = register(Counter('rcam_frames_processed_total', 'frames scaled and encoded'))
+frames_published = register(Counter('rcam_frames_published_total', 'frames published to subscribers'))
+frames_dropped = register(Counter('rcam_frames_dropped_total', 'frames that went no further than a stage'))
+stage_seconds = register(Histogram('rcam_stage_seconds', 'time each frame spends in a pipeline stage', latency_buckets))
+bytes_sent = register(Counter('rcam_bytes_sent_total', 'bytes published on each topic'))
+encoder_queue = register(Gauge('rcam_encoder_queue_depth', 'frames with the encoder workers or waiting to be published in order'))
+api_commands = register(Counter('rcam_api_commands_total', 'api commands handled'))
+register(Gauge('rcam_process_resident_bytes', 'resident memory of the server process', fn=process_rss))
+register(Gauge('rcam_process_cpu_seconds', 'cpu time used by the server process', fn=process_cpu))
+
+
+class Probe:
+    """Times the stage before it and counts the frames that were dropped in it.
+    
+    Probes go between the operators of a pipeline. The time between a frame passing one
+    probe and the next is the time it spent in the stage between them. Each frame carries
+    the number of frames before it that didn't reach the last probe, in DroppedFrames, so
+    the frames dropped in the stage are the ones missing here that weren't missing there.
+    The running count for each stage is published too, in StageDrops.
+    """
+    
+    def __init__(self, camera, stage, counter=None):
+        self.camera = camera
+        self.stage = stage
+        self.counter = counter
+        self.passed = 0
+        self.dropped = 0
+    
+    def __call__(self, pipe):
+        for item in pipe:
+            now = time.monotonic()
+            if (start := item.get('probe_time', None)) is not None:
+                stage_seconds.observe(now - start, camera=self.camera, stage=self.stage)
+            item['probe_time'] = now
+            
+            self.passed += 1
+            if (metadata := item.get('metadata', None)) is not None:
+                missing = item['idx'] + 1 - self.passed
+                if (dropped := missing - metadata.get('DroppedFrames', 0)) > self.dropped:
+                    frames_dropped.inc(dropped - self.dropped, camera=self.camera, stage=self.stage)
+                    self.dropped = dropped
+                metadata['DroppedFrames'] = missing
+                metadata['StageDrops'] = dict(metadata.get('StageDrops', {}), **{self.stage: self.dropped})
+            
+            if self.counter is not None:
+                self.counter.inc(camera=self.camera)
+            
+            yield item
+
+
+class MetricsServer(threading.Thread):
+    def __init__(self, address, port):
+        super().__init__()
+        self.over = False
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path not in ('/', '/metrics'):
+                    self.send_error(404)
+                    return
+                body = render().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.httpd = HTTPServer((address, port), Handler)
+        self.httpd.timeout = 0.2
+
+    def run(self):
+        print("metrics_server: start")
+
+        while self.over == False:
+            self.httpd.handle_request()
+        self.httpd.server_close()
+
+        print("metrics_server: finish")
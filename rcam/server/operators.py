@@ -2,6 +2,8 @@ from itertools import count
 import json
 import sys
 import io
+import time
+import threading
 import zmq
 
 from PIL import Image
@@ -13,6 +15,8 @@ except:
     pass
 
 from .commands import PubSubCommands
+from .. import rgbimg
+from . import metrics
 
 
 image_dtypes = {
@@ -24,8 +28,12 @@ image_dtypes = {
     'SGRBG16': np.uint16,
     'SGBRG16': np.uint16,
     'SRGGB16': np.uint16,
+    'YUV420': np.uint8,
 }
 
+# the most frames a burst captures
+max_burst = 32
+
 
 def control(svr_socket):
     
@@ -44,19 +52,83 @@ def control(svr_socket):
         yield item
 
 
-def capture(pipe, camera, arrays):
+def yuv420_planes(image):
+    """Views onto the Y, U and V planes of a packed I420 image."""
+    
+    height, width = image.shape[0] * 2 // 3, image.shape[1]
+    y_size, c_size = width * height, (width // 2) * (height // 2)
+    
+    flat = image.reshape(-1)
+    y = flat[:y_size].reshape(height, width)
+    u = flat[y_size:y_size+c_size].reshape(height // 2, width // 2)
+    v = flat[y_size+c_size:y_size+2*c_size].reshape(height // 2, width // 2)
+    return y, u, v
+
+
+def yuv420_pack(y, u, v):
+    """Pack the planes into one I420 image, the layout opencv uses."""
+    return np.concatenate((y.reshape(-1), u.reshape(-1), v.reshape(-1))).reshape(-1, y.shape[1])
+
+
+def yuv420_frame(image, size, stride):
+    # the camera pads each row out to the stride, which needs removing for a packed image
+    width, height = size
+    if stride == width:
+        return image[:height * 3 // 2]
+    
+    flat = image.reshape(-1)
+    c_stride = stride // 2
+    y = image[:height, :width]
+    u = flat[stride*height:stride*height + c_stride*height//2].reshape(height // 2, c_stride)[:, :width//2]
+    v = flat[stride*height + c_stride*height//2:stride*height + c_stride*height].reshape(height // 2, c_stride)[:, :width//2]
+    return yuv420_pack(y, u, v)
+
+
+def luma(entry):
+    """The image, or just its Y plane if it's YUV."""
+    
+    if entry['format'] == 'YUV420':
+        return yuv420_planes(entry['image'])[0]
+    return entry['image']
+
+
+def capture_arrays(dtype):
+    # the raw image types need the raw stream as well as main
+    return ['main', 'raw'] if dtype in ('rl8', 'rg8') else ['main']
+
+
+def reconfigure(camera, settings, dtype):
+    """Switch the camera to a new mode, flips or image type, returning the image type in use."""
+    
+    new_dtype = settings.get('DType', dtype)
+    try:
+        camera.switch_config_(
+            mode=settings.get('Mode', None),
+            hflip=settings.get('HFlip', None),
+            vflip=settings.get('VFlip', None),
+            yuv=(new_dtype in ('yuv', 'y8'))
+        )
+    except ValueError as e:
+        print(f"reconfigure: {e}")
+        return dtype
+    
+    return new_dtype
+
+
+def capture(pipe, camera, *, dtype='rgb'):
     # get the camera capturing
+    arrays = capture_arrays(dtype)
     job = camera.capture_arrays(arrays, wait=False)    
 
     # start the main loop
     for item in pipe:
         # handle the capture
         images, metadata = camera.wait(job)
-        job = camera.capture_arrays(arrays, wait=False)
 
         # build the item to yield
         item['metadata'] = metadata
         item['metadata']['CameraModel'] = camera.camera_properties['Model']
+        item['metadata']['ImageType'] = dtype
         
         image_key = 'raw' if 'raw' in item else 'main'
         item['metadata']['ImageSize'] = camera.camera_config[image_key]['size']
@@ -72,11 +144,204 @@ def capture(pipe, camera, arrays):
                 'size': camera.camera_config[array]['size'],
                 'stride': camera.camera_config[array]['stride']
             }
+            
+            # yuv is passed on as planar I420 with no padding, or as just the Y plane
+            if image_format == 'YUV420':
+                entry = item[array]
+                width, height = entry['size']
+                if dtype == 'y8':
+                    entry['image'] = entry['image'][:height, :width]
+                    entry['format'] = 'Y8'
+                else:
+                    entry['image'] = yuv420_frame(entry['image'], entry['size'], entry['stride'])
+        
+        # the frame is built, so the camera can be switched before capturing the next one
+        if (settings := item['controls'].get('Reconfigure', None)) is not None:
+            dtype = reconfigure(camera, settings, dtype)
+            arrays = capture_arrays(dtype)
+        
+        job = camera.capture_arrays(arrays, wait=False)
+
+        yield item
+
 
+def sensor_drops(pipe, *, camera_label='0'):
+    """Counts the frames the sensor produced that were never captured, from the gaps in their timestamps."""
+    
+    dropped = 0
+    prev_ts = None
+    prev_size = None
+    
+    for item in pipe:
+        metadata = item['metadata']
+        ts = metadata.get('SensorTimestamp', None)
+        frame_duration = metadata.get('FrameDuration', None)
+        
+        # a change of size means the camera was restarted, which leaves a gap that isn't a drop
+        size = metadata.get('ImageSize', None)
+        if prev_ts is not None and ts is not None and frame_duration and size == prev_size:
+            missed = round((ts - prev_ts) / (frame_duration * 1000)) - 1
+            if missed > 0:
+                dropped += missed
+                metrics.frames_dropped.inc(missed, camera=camera_label, stage='sensor')
+        
+        metadata['SensorDropped'] = dropped
+        
+        # the camera is restarted after this frame for a new mode
+        prev_ts = None if item['controls'].get('Reconfigure', None) is not None else ts
+        prev_size = size
+        
         yield item
 
 
-def focus(pipe, camera):
+def isp_target(camera, fit_mode, width, height):
+    """The second output size and sensor crop for a fit, or None if it needs the full image."""
+    from .camera import lores_size
+    
+    sensor_w, sensor_h = camera.sensor_mode_['size']
+    crop_x, crop_y, crop_w, crop_h = camera.sensor_mode_['crop_limits']
+    
+    if fit_mode == 'scaled' and (width < sensor_w or height < sensor_h):
+        return lores_size((sensor_w, sensor_h), (width, height)), (crop_x, crop_y, crop_w, crop_h)
+    
+    if fit_mode == 'cropped' and (width < sensor_w or height < sensor_h):
+        size = lores_size((min(width, sensor_w), min(height, sensor_h)), (width, height))
+        
+        # the crop is in sensor pixels, which the mode may have binned
+        scaled_w, scaled_h = int(size[0] * crop_w / sensor_w), int(size[1] * crop_h / sensor_h)
+        crop = (crop_x + (crop_w - scaled_w)//2, crop_y + (crop_h - scaled_h)//2, scaled_w, scaled_h)
+        return size, crop
+    
+    return None
+
+
+def isp_capture(pipe, camera, *, fit_mode='scaled', settle=0.5):
+    """Capture images already fitted to the viewer by the isp's second output.
+    
+    Changes to the fit are applied once they have settled, as resizing the output
+    restarts the camera. The full size image is only captured if the fit needs it
+    or an operator has asked for it in camera.full_res_, for a burst or focus sweep.
+    """
+    
+    width = height = sys.maxsize
+    full_crop = tuple(camera.sensor_mode_['crop_limits'])
+    
+    applied = None
+    requested = None
+    requested_time = 0.0
+    
+    arrays = ['main']
+    job = camera.capture_arrays(arrays, wait=False)
+    
+    for item in pipe:
+        ctrls = item['controls']
+        fit_mode = ctrls.get('FitMode', fit_mode)
+        width = ctrls.get('Width', width)
+        height = ctrls.get('Height', height)
+        
+        # the burst operator clears this once it has its frames
+        if ctrls.get('Burst', None) is not None:
+            camera.full_res_.add('burst')
+        
+        images, metadata = camera.wait(job)
+        
+        image_key = arrays[0]
+        image_format = camera.camera_config[image_key]['format']
+        image = images[0].view(image_dtypes[image_format])
+        image_size = tuple(camera.camera_config[image_key]['size'])
+        
+        if image_format == 'YUV420':
+            stride = camera.camera_config[image_key]['stride']
+            image = yuv420_to_rgb(*yuv420_planes(yuv420_frame(image, image_size, stride)))
+        
+        item['metadata'] = metadata
+        item['metadata']['CameraModel'] = camera.camera_properties['Model']
+        item['metadata']['ImageType'] = 'rgb'
+        item['metadata']['ImageSize'] = image_size
+        
+        # whether the image has been fitted, going by the crop it was actually captured with
+        isp_fit = None
+        if image_key == 'lores':
+            isp_fit = fit_mode
+        elif tuple(metadata.get('ScalerCrop', full_crop)) != full_crop:
+            isp_fit = 'cropped'
+        item['metadata']['IspFit'] = isp_fit
+        
+        # downstream, the image is always main
+        item['main'] = {
+            'image': image,
+            'format': camera.camera_config['main']['format'],
+            'framesize': image.nbytes,
+            'size': image_size,
+            'stride': image.strides[0]
+        }
+        
+        # a new mode starts over at full size. the isp only makes rgb images, so the type stays
+        if (settings := ctrls.get('Reconfigure', None)) is not None:
+            reconfigure(camera, dict(settings, DType='rgb'), 'rgb')
+            full_crop = tuple(camera.sensor_mode_['crop_limits'])
+            applied = requested = None
+        
+        now = time.monotonic()
+        target = None if camera.full_res_ else isp_target(camera, fit_mode, width, height)
+        if target != requested:
+            requested, requested_time = target, now
+        
+        # go to the full image straight away, but wait for resizes to settle
+        if requested != applied and (requested is None or now - requested_time >= settle):
+            if requested is None:
+                camera.set_controls({'ScalerCrop': full_crop})
+            else:
+                camera.set_isp_fit_(*requested)
+            applied = requested
+        
+        arrays = ['main'] if applied is None else ['lores']
+        job = camera.capture_arrays(arrays, wait=False)
+        
+        yield item
+
+
+def focus_score(image, roi):
+    """The variance of the laplacian of the green channel inside the roi."""
+    
+    image_h, image_w = image.shape[:2]
+    x, y, w, h = roi
+    x0, x1 = int(x * image_w), int((x + w) * image_w)
+    y0, y1 = int(y * image_h), int((y + h) * image_h)
+    
+    g = image[y0:y1, x0:x1, 1] if image.ndim == 3 else image[y0:y1, x0:x1]
+    g = g.astype(np.float32)
+    if g.shape[0] < 3 or g.shape[1] < 3:
+        return 0.0
+    
+    lap = 4*g[1:-1, 1:-1] - g[:-2, 1:-1] - g[2:, 1:-1] - g[1:-1, :-2] - g[1:-1, 2:]
+    return float(lap.var())
+
+
+def focus_sweep(lp_min, lp_max, *, steps=9, passes=2):
+    """Generates lens positions to try, each time being sent the score for the last one.
+    
+    Each pass sweeps the range evenly and the next pass narrows the range to either side 
+    of the best position so far. Returns the best position found.
+    """
+    
+    lo, hi = lp_min, lp_max
+    best_lp, best_score = lp_min, -1.0
+    
+    for _ in range(passes):
+        step = (hi - lo) / (steps - 1)
+        for i in range(steps):
+            lp = lo + i * step
+            score = yield lp
+            if score > best_score:
+                best_lp, best_score = lp, score
+        
+        lo, hi = max(lp_min, best_lp - step), min(lp_max, best_lp + step)
+    
+    return best_lp
+
+
+def focus(pipe, camera, *, roi=(0.375, 0.375, 0.25, 0.25), settle_frames=6):
     
     # check if focus is supported
     mdata = camera.capture_metadata()
@@ -89,14 +354,23 @@ def focus(pipe, camera):
             'AfTrigger': controls.AfTriggerEnum.Start
         }
         camera.set_controls(ctrls)
+        
+        lp_min, lp_max, _ = camera.camera_controls['LensPosition']
+        lp_tolerance = (lp_max - lp_min) * 0.01
     
     af_enable = can_focus
     
+    # the state of any sweep in progress
+    sweep = None
+    sweep_lp = 0.0
+    sweep_wait = 0
+    
     for item in pipe:
         ctrls = item['controls']
         local_ctrls = {}
         if (ctrl_af_enable := ctrls.get('AfEnable', None)) is not None:
             af_enable = ctrl_af_enable
+            sweep = None
             if af_enable:
                 local_ctrls['AfMode'] = controls.AfModeEnum.Auto
                 local_ctrls['AfTrigger'] = controls.AfTriggerEnum.Start
@@ -105,20 +379,57 @@ def focus(pipe, camera):
                 local_ctrls['AfMode'] = controls.AfModeEnum.Manual
         
         if ctrls.get('AfTrigger', False):
+            sweep = None
             local_ctrls['AfTrigger'] = controls.AfTriggerEnum.Start
         
         if (lp := ctrls.get('LensPosition', None)) is not None:
             af_enable = False
+            sweep = None
             local_ctrls['AfMode'] = controls.AfModeEnum.Manual
             local_ctrls['LensPosition'] = lp
         
+        roi = ctrls.get('FocusRoi', roi)
+        
+        # scores are only comparable on the full image, not one the isp has scaled or cropped
+        metadata = item['metadata']
+        score = None
+        if metadata.get('IspFit', None) is None:
+            score = focus_score(luma(item['main']), roi)
+            metadata['FocusScore'] = score
+        
+        if can_focus and ctrls.get('AfSweep', False):
+            af_enable = False
+            sweep = focus_sweep(lp_min, lp_max)
+            sweep_lp = next(sweep)
+            sweep_wait = settle_frames
+            local_ctrls['AfMode'] = controls.AfModeEnum.Manual
+            local_ctrls['LensPosition'] = sweep_lp
+            
+            # with the isp fitting images, sweep on the full size images
+            camera.full_res_.add('focus')
+        
+        elif sweep is not None and score is not None:
+            # wait for the lens to get to the position before using the score
+            sweep_wait -= 1
+            if sweep_wait <= 0 or abs(metadata.get('LensPosition', lp_min) - sweep_lp) < lp_tolerance:
+                try:
+                    sweep_lp = sweep.send(score)
+                    sweep_wait = settle_frames
+                except StopIteration as stop:
+                    sweep_lp = stop.value
+                    sweep = None
+                local_ctrls['LensPosition'] = sweep_lp
+        
         if can_focus and len(local_ctrls):
             camera.set_controls(local_ctrls)
         
+        if sweep is None:
+            camera.full_res_.discard('focus')
+        
         # insert the AfEnable item into the metadata
         if can_focus:
-            metadata = item['metadata']
             metadata['AfEnable'] = af_enable
+            metadata['AfSweep'] = sweep is not None
         
         yield item
 
@@ -162,24 +473,623 @@ def exposure(pipe, camera):
         yield item
 
 
-def jpeg_encoder(pipe):
+def burst(pipe, camera, context, side_url, *, max_frames=max_burst, settle_frames=6):
+    
+    frames = []
+    count = 0
+    exposures = []
+    wait = 0
+    restore = {}
+    burst_id = 0
+    
+    # controls that arrive during a burst are held until it's over
+    held_ctrls = {}
+    
+    for item in pipe:
+        ctrls = item['controls']
+        metadata = item['metadata']
+        
+        if count == 0 and len(held_ctrls):
+            held_ctrls.update(ctrls)
+            item['controls'] = ctrls = held_ctrls
+            held_ctrls = {}
+        
+        if (request := ctrls.get('Burst', None)) is not None and count == 0:
+            count, exposures = request
+            if count <= 0:
+                count = 0
+                camera.full_res_.discard('burst')
+                yield item
+                continue
+            if count > max_frames:
+                print(f"burst: {count} frames asked for, capturing {max_frames}")
+                count = max_frames
+            frames = []
+            wait = settle_frames
+            restore = {}
+            burst_id += 1
+            
+            # at the sensor's maximum rate, whatever the frame rate is limited to.
+            #   frame_rate puts the limit back once the burst is over
+            camera.full_res_.add('burst')
+            min_fd, max_fd, _ = camera.camera_controls['FrameDurationLimits']
+            camera.set_controls({'FrameDurationLimits': (min_fd, max_fd)})
+            
+            # bracketing needs manual exposure. put things back how they were afterwards
+            if len(exposures):
+                if metadata.get('AeEnable', True):
+                    restore = {'AeEnable': True}
+                else:
+                    restore = {
+                        'ExposureTime': metadata['ExposureTime'],
+                        'AnalogueGain': metadata['AnalogueGain']
+                    }
+                camera.set_controls({'AeEnable': False, 'ExposureTime': exposures[0]})
+            
+            # this frame was captured before the burst was requested
+            yield item
+            continue
+        
+        if count == 0:
+            yield item
+            continue
+        
+        held_ctrls.update(ctrls)
+        
+        # bursting: keep the frame if it's what was asked for, and don't pass anything down
+        #   the pipeline so the capture runs at the sensor rate
+        keep = True
+        wait -= 1
+        if len(exposures):
+            target = exposures[len(frames) % len(exposures)]
+            keep = wait <= 0 or abs(metadata['ExposureTime'] - target) <= 0.05 * target
+        elif metadata.get('FrameDuration', 0) > 1.05 * min_fd:
+            # the new frame duration takes a few frames to come through
+            keep = wait <= 0
+        
+        # with the isp fitting images, wait for the full size images to come through
+        if metadata.get('IspFit', None) is not None:
+            keep = False
+        
+        if keep:
+            image_key = 'raw' if 'raw' in item else 'main'
+            frame = {
+                'idx': len(frames),
+                'controls': {},
+                'metadata': metadata.copy(),
+                image_key: item[image_key].copy()
+            }
+            frame[image_key]['image'] = item[image_key]['image'].copy()
+            frame['metadata']['BurstId'] = burst_id
+            frame['metadata']['BurstIndex'] = len(frames)
+            frame['metadata']['BurstCount'] = count
+            frames.append(frame)
+            
+            if len(exposures) and len(frames) < count:
+                wait = settle_frames
+                camera.set_controls({'ExposureTime': exposures[len(frames) % len(exposures)]})
+        
+        if len(frames) == count:
+            if len(restore):
+                camera.set_controls(restore)
+                restore = {}
+            camera.full_res_.discard('burst')
+            
+            thread = threading.Thread(target=burst_sender, args=(frames, context, side_url))
+            thread.start()
+            
+            frames = []
+            count = 0
+
+
+def motion_thumbnail(image, image_format, width=64):
+    import cv2
+    from .operators_raw import bayer_scale
+    
+    image_h, image_w = image.shape[:2]
+    height = max(1, round(image_h * width / image_w))
+    
+    # area resizing reads every pixel, so skip down to about four times the thumbnail first.
+    #   an odd step keeps all the colours of a bayer image in the samples
+    step = max(1, image_w // (4 * width))
+    if image.dtype == np.uint16 and step % 2 == 0:
+        step -= 1
+    if step > 1:
+        image = image[::step, ::step]
+    
+    thumb = cv2.resize(image, (width, height), interpolation=cv2.INTER_AREA).astype(np.float32)
+    
+    # a luma image. the channel order doesn't matter for detecting change
+    if thumb.ndim == 3:
+        thumb = thumb[:, :, :3].mean(axis=2)
+    
+    # compare raw images on the same scale as 8bit ones
+    if image.dtype == np.uint16:
+        thumb *= bayer_scale.get(image_format, 1.0) * 255.0 / 65535.0
+    
+    return thumb
+
+
+def motion_gate(pipe, *, threshold, heartbeat=5.0):
+    """Only pass on frames that differ from the last one passed on, plus one every heartbeat seconds.
+    
+    The difference is the mean absolute difference between small luma thumbnails, in 8bit grey levels.
+    """
+    
+    reference = None
+    last_time = 0.0
+    skipped = 0
+    
+    # controls from skipped frames are passed on with the next frame
+    held_ctrls = {}
+    
+    for item in pipe:
+        ctrls = item['controls']
+        if len(held_ctrls):
+            held_ctrls.update(ctrls)
+            item['controls'] = ctrls = held_ctrls
+            held_ctrls = {}
+        
+        if threshold <= 0 or ctrls.get('Over', False):
+            yield item
+            continue
+        
+        image_key = 'raw' if 'raw' in item else 'main'
+        thumb = motion_thumbnail(luma(item[image_key]), item[image_key]['format'])
+        
+        score = None
+        if reference is not None and reference.shape == thumb.shape:
+            score = float(np.abs(thumb - reference).mean())
+        
+        now = time.monotonic()
+        is_heartbeat = now - last_time >= heartbeat
+        
+        if score is not None and score < threshold and not is_heartbeat:
+            held_ctrls.update(ctrls)
+            skipped += 1
+            continue
+        
+        metadata = item['metadata']
+        metadata['MotionScore'] = -1.0 if score is None else round(score, 2)
+        metadata['MotionHeartbeat'] = score is not None and score < threshold
+        metadata['MotionSkipped'] = skipped
+        
+        reference = thumb
+        last_time = now
+        skipped = 0
+        
+        yield item
+
+
+def burst_sender(frames, context, side_url):
+    from .operators_raw import raw_convert
+    
+    side_sock = context.socket(zmq.PUSH)
+    side_sock.connect(side_url)
+    
+    # encode at full size and quality. sending blocks until the server has passed the last ones on
+    pipe = iter(frames)
+    pipe = raw_convert(pipe)
+    pipe = jpeg_encoder(pipe, quality=95)
+    
+    for item in pipe:
+        idx = f"{item['metadata']['BurstIndex']}".encode('utf-8')
+        metadata = { k: v for k, v in item['metadata'].items() if not k.endswith('StatsOutput') }
+        metajs = json.dumps(metadata, separators=(',',':')).encode('utf-8')
+        side_sock.send_multipart([PubSubCommands.BURST_METADATA, idx, metajs])
+        side_sock.send_multipart([PubSubCommands.BURST_JPEGIMG, idx, item['jpeg']])
+    
+    side_sock.close()
+
+
+def still(pipe, camera, context, side_url, *, quality=100, settle_frames=6):
+    """Capture single full resolution stills on request, leaving the stream as it is.
+    
+    The still is a capture of its own from the camera's full size streams, so the stream
+    keeps its size and fit and only misses the frame the still was taken from. It's
+    encoded and sent on the still topic from a thread of its own.
+    """
+    
+    still_id = 0
+    
+    for item in pipe:
+        if (request := item['controls'].get('Still', None)) is None:
+            yield item
+            continue
+        
+        arrays = ['main', 'raw'] if request['Raw'] else ['main']
+        
+        # the isp's cropped fit narrows the crop for the full size stream too, so widen it
+        #   for the still and put it back afterwards
+        full_crop = crop = None
+        if getattr(camera, 'isp_', False):
+            full_crop = tuple(camera.sensor_mode_['crop_limits'])
+            crop = tuple(item['metadata'].get('ScalerCrop', full_crop))
+        if crop != full_crop:
+            camera.set_controls({'ScalerCrop': full_crop})
+            for _ in range(settle_frames):
+                images, metadata = camera.capture_arrays(arrays)
+                if tuple(metadata.get('ScalerCrop', full_crop)) == full_crop:
+                    break
+            else:
+                print("still: the full crop didn't take, the still is cropped")
+            camera.set_controls({'ScalerCrop': crop})
+        else:
+            images, metadata = camera.capture_arrays(arrays)
+        still_id += 1
+        
+        frame = {
+            'idx': still_id,
+            'metadata': metadata
+        }
+        frame['metadata']['CameraModel'] = camera.camera_properties['Model']
+        frame['metadata']['StillId'] = still_id
+        
+        for array, image in zip(arrays, images):
+            image_format = camera.camera_config[array]['format']
+            image_size = camera.camera_config[array]['size']
+            image = image.view(image_dtypes.get(image_format, np.uint16))
+            
+            if image_format == 'YUV420':
+                image = yuv420_frame(image, image_size, camera.camera_config[array]['stride'])
+            elif array == 'raw':
+                image = image[:, :image_size[0]]
+            
+            frame[array] = {
+                'image': image,
+                'format': image_format,
+                'size': image_size
+            }
+        
+        frame['metadata']['ImageSize'] = frame['main']['size']
+        if request['Raw']:
+            frame['metadata']['RawFormat'] = frame['raw']['format']
+            frame['metadata']['RawSize'] = frame['raw']['size']
+        
+        thread = threading.Thread(target=still_sender, args=(frame, context, side_url), kwargs={'quality': quality})
+        thread.start()
+        
+        yield item
+
+
+def still_sender(frame, context, side_url, *, quality):
+    side_sock = context.socket(zmq.PUSH)
+    side_sock.connect(side_url)
+    
+    idx = f"{frame['idx']}".encode('utf-8')
+    metadata = { k: v for k, v in frame['metadata'].items() if not k.endswith('StatsOutput') }
+    metajs = json.dumps(metadata, separators=(',',':')).encode('utf-8')
+    
+    main = frame['main']
+    jpeg = encode_jpeg(main['image'], main['format'], quality=quality)
+    
+    # it all goes in the one message so a subscriber gets all of the still or none of it
+    parts = [PubSubCommands.STILL, idx, metajs, jpeg]
+    if (raw := frame.get('raw', None)) is not None:
+        parts.extend(rgbimg.encode(raw['image']))
+    side_sock.send_multipart(parts)
+    
+    side_sock.close()
+
+
+def encode_jpeg(image, image_format=None, quality=95):
+    # jpeg is yuv anyway, so yuv images are encoded from their planes without any colour conversion
+    if image_format == 'YUV420':
+        return encode_jpeg_yuv420(*yuv420_planes(image), quality=quality)
+    
+    jpeg = io.BytesIO()
+    Image.fromarray(image).save(jpeg, format='jpeg', quality=quality)
+    return jpeg.getvalue()
+
+
+def yuv420_image(y, u, v):
+    # the camera is set to the full range sYCC colour space, the same as jpeg, which pillow understands
+    import cv2
+    height, width = y.shape
+    planes = [Image.fromarray(p) for p in (y, cv2.resize(u, (width, height)), cv2.resize(v, (width, height)))]
+    return Image.merge('YCbCr', planes)
+
+
+def yuv420_to_rgb(y, u, v):
+    return np.array(yuv420_image(y, u, v).convert('RGB'))
+
+
+def encode_jpeg_yuv420(y, u, v, quality=95):
+    try:
+        import simplejpeg
+        return simplejpeg.encode_jpeg_yuv_planes(y, u, v, quality=quality)
+    except ImportError:
+        pass
+    
+    # pillow takes the planes at full size, but still writes 4:2:0 without converting the colour
+    jpeg = io.BytesIO()
+    yuv420_image(y, u, v).save(jpeg, format='jpeg', quality=quality, subsampling='4:2:0')
+    return jpeg.getvalue()
+
+
+def rgb_image(entry):
+    """The image as rgb, for the consumers that can't use yuv."""
+    
+    if entry['format'] == 'YUV420':
+        return yuv420_to_rgb(*yuv420_planes(entry['image']))
+    return entry['image']
+
+
+def jpeg_encoder(pipe, *, quality=None):
     
     for item in pipe:
         image_key = 'raw' if 'raw' in item else 'main'
         image = item[image_key]['image']
 
-        image = Image.fromarray(image)
+        # the thermal governor lowers the quality as the Pi heats up
+        image_quality = item['metadata'].get('ThermalQuality', 95) if quality is None else quality
+        item['jpeg'] = encode_jpeg(image, item[image_key]['format'], image_quality)
         
-        jpeg = io.BytesIO()
-        image.save(jpeg, format='jpeg', quality=95)
-        jpeg.seek(0, io.SEEK_SET)
+        yield item
+
+
+def rgb_encoder(pipe, *, compression):
+    
+    for item in pipe:
+        image_key = 'raw' if 'raw' in item else 'main'
+        image = rgb_image(item[image_key])
+
+        item['rgb'] = rgbimg.encode(image, compression=compression)
+        
+        yield item
+
+
+def tile_encoder(pipe, *, tile_size=128, refresh=2.0, pixel_threshold=24, min_pixels=16):
+    """Send a full jpeg every refresh seconds and in between, only the tiles that have changed.
+    
+    A tile has changed if more than min_pixels of its pixels differ from the last version
+    sent by more than pixel_threshold. Each tiles message names the image message it
+    builds on so a receiver that missed one can wait for the next full image.
+    """
+    import cv2
+    
+    reference = None
+    last_idx = None
+    last_refresh = 0.0
+    
+    for item in pipe:
+        image_key = 'raw' if 'raw' in item else 'main'
+        image = np.ascontiguousarray(rgb_image(item[image_key]))
+        image_h, image_w = image.shape[:2]
+        quality = item['metadata'].get('ThermalQuality', 95)
+        
+        now = time.monotonic()
+        if reference is None or reference.shape != image.shape or now - last_refresh >= refresh:
+            item['jpeg'] = encode_jpeg(image, quality=quality)
+            reference = image.copy()
+            last_idx = item['idx']
+            last_refresh = now
+            yield item
+            continue
+        
+        # count the changed pixels in each tile
+        diff = cv2.absdiff(image, reference)
+        if diff.ndim == 3:
+            diff = diff.max(axis=2)
+        changed = (diff > pixel_threshold).astype(np.uint16)
+        
+        ny, nx = -(-image_h // tile_size), -(-image_w // tile_size)
+        changed = np.pad(changed, ((0, ny*tile_size - image_h), (0, nx*tile_size - image_w)))
+        counts = changed.reshape(ny, tile_size, nx, tile_size).sum(axis=(1, 3), dtype=np.uint32)
+        
+        tiles = []
+        jpegs = []
+        for ty, tx in zip(*np.nonzero(counts > min_pixels)):
+            y0, x0 = int(ty) * tile_size, int(tx) * tile_size
+            tile = image[y0:y0+tile_size, x0:x0+tile_size]
+            
+            tiles.append((x0, y0))
+            jpegs.append(encode_jpeg(tile, quality=quality))
+            reference[y0:y0+tile_size, x0:x0+tile_size] = tile
         
-        item['jpeg'] = jpeg.getvalue()
+        if len(tiles):
+            header = {
+                'size': (image_w, image_h),
+                'prev': last_idx,
+                'tiles': tiles
+            }
+            item['tiles'] = (json.dumps(header, separators=(',',':')).encode('utf-8'), jpegs)
+            last_idx = item['idx']
         
         yield item
 
 
-def publisher(pipe, pub_sock, svr_socket):
+def image_encoder(pipe, encoding, *, tile_size=128, refresh=2.0):
+    """Encode the images as jpeg, as changed jpeg tiles, or as rgb with the named compression."""
+    
+    if encoding == 'jpeg':
+        return jpeg_encoder(pipe)
+    
+    if encoding == 'tiles':
+        return tile_encoder(pipe, tile_size=tile_size, refresh=refresh)
+    
+    compression = 'none' if encoding == 'rgb' else encoding
+    if compression not in rgbimg.available:
+        raise ValueError(f"{compression} compression needs its python package installed")
+    
+    return rgb_encoder(pipe, compression=compression)
+
+
+# the thermal governor's steps, as (fps, scale, jpeg quality). an fps of 0 is no limit
+thermal_ladder = [
+    (0, 1.0, 95),
+    (0, 1.0, 85),
+    (20, 0.75, 85),
+    (15, 0.5, 80),
+    (10, 0.5, 75),
+    (5, 0.5, 70),
+]
+
+
+def soc_temperature():
+    try:
+        with open('/sys/class/thermal/thermal_zone0/temp') as f:
+            return int(f.read()) / 1000.0
+    except (OSError, ValueError):
+        pass
+    
+    import psutil
+    for name, sensors in getattr(psutil, 'sensors_temperatures', dict)().items():
+        if len(sensors):
+            return sensors[0].current
+    
+    return None
+
+
+def thermal_governor(pipe, *, ladder=None, high_temp=75.0, low_temp=65.0, high_load=85.0, low_load=60.0, interval=1.0, step_down=5.0, step_up=30.0):
+    """Step down a ladder of frame rate, output scale and jpeg quality as the Pi heats up, and back up as it cools.
+    
+    A step down is taken at most every step_down seconds while the soc is above high_temp, the
+    load is above high_load, or the cpu is being held below its top frequency while busy. A step
+    back up needs step_up seconds below all the low marks, so the level settles instead of
+    oscillating. The frame_rate, output_scale and jpeg encoders act on the level in the metadata.
+    """
+    import psutil
+    
+    ladder = thermal_ladder if ladder is None else ladder
+    
+    level = 0
+    last_sample = 0.0
+    last_change = time.monotonic()
+    calm_since = None
+    
+    temp = freq = load = None
+    psutil.cpu_percent()
+    
+    for item in pipe:
+        now = time.monotonic()
+        if now - last_sample >= interval:
+            last_sample = now
+            
+            temp = soc_temperature()
+            load = psutil.cpu_percent()
+            cpu_freq = psutil.cpu_freq()
+            freq = None if cpu_freq is None else round(cpu_freq.current)
+            
+            # the frequency drops when idle as well, so it only counts when busy
+            capped = cpu_freq is not None and cpu_freq.max > 0 and cpu_freq.current < 0.95 * cpu_freq.max and load >= low_load
+            hot = (temp is not None and temp >= high_temp) or load >= high_load or capped
+            cool = (temp is None or temp <= low_temp) and load <= low_load and not capped
+            
+            if hot:
+                calm_since = None
+                if level < len(ladder) - 1 and now - last_change >= step_down:
+                    level, last_change = level + 1, now
+            elif cool:
+                calm_since = now if calm_since is None else calm_since
+                if level > 0 and now - calm_since >= step_up and now - last_change >= step_up:
+                    level, last_change = level - 1, now
+            else:
+                calm_since = None
+        
+        fps, scale, quality = ladder[level]
+        
+        metadata = item['metadata']
+        metadata['ThermalLevel'] = level
+        metadata['ThermalFps'] = fps
+        metadata['ThermalScale'] = scale
+        metadata['ThermalQuality'] = quality
+        metadata['SocTemperature'] = temp
+        metadata['CpuFrequency'] = freq
+        metadata['CpuLoad'] = load
+        
+        yield item
+
+
+def frame_rate(pipe, camera, *, max_fps=0, governor=False, headroom=1.25, min_fps=1.0, interval=2.0, worker_time=None):
+    """Limit the sensor frame rate, to a set maximum or, with the governor, to what the pipeline keeps up with.
+    
+    The governor times the stages after this one for each frame. Frames arriving faster than
+    that are only dropped later, so the frame duration is set to the processing time plus
+    some headroom, which also leaves the exposure more room at low frame rates. When the
+    frames are processed in worker processes, worker_time returns the seconds of their time
+    each frame takes.
+    """
+    
+    def set_limit(fps):
+        # a burst runs at the sensor's maximum rate, the limit is put back once it's over
+        if 'burst' not in camera.full_res_:
+            fd = max(min_fd, int(1000000/fps)) if fps > 0 else min_fd
+            camera.set_controls({'FrameDurationLimits': (fd, max_fd)})
+        return fps
+    
+    def ceiling():
+        # the lowest of the set maximum and the thermal governor's, 0 for none
+        limits = [f for f in (max_fps, thermal_fps) if f > 0]
+        return min(limits) if len(limits) else 0
+    
+    limit = max_fps
+    thermal_fps = 0
+    min_fd = None
+    busy = None
+    next_update = 0.0
+    bursting = False
+    
+    for item in pipe:
+        ctrls = item['controls']
+        
+        if bursting and 'burst' not in camera.full_res_:
+            set_limit(limit)
+        bursting = 'burst' in camera.full_res_
+        
+        # the limits depend on the sensor mode, which can be switched
+        if min_fd is None or ctrls.get('Reconfigure', None) is not None:
+            min_fd, max_fd, _ = camera.camera_controls['FrameDurationLimits']
+            sensor_fps = 1000000 / min_fd
+            if limit > 0:
+                set_limit(limit)
+        
+        if (fps := ctrls.get('MaxFps', None)) is not None:
+            max_fps = fps
+            limit = set_limit(ceiling())
+            busy = None
+        
+        if (enable := ctrls.get('FpsGovernor', None)) is not None:
+            governor = enable
+            if governor == False:
+                limit = set_limit(ceiling())
+        
+        # the thermal governor's limit applies straight away, whether this governor is on or not
+        if (fps := item['metadata'].get('ThermalFps', 0)) != thermal_fps:
+            thermal_fps = fps
+            if not governor or limit == 0 or limit > ceiling() > 0:
+                limit = set_limit(ceiling())
+        
+        item['metadata']['FpsLimit'] = limit
+        item['metadata']['FpsGovernor'] = governor
+        
+        start = time.monotonic()
+        yield item
+        elapsed = time.monotonic() - start
+        
+        # the burst keeps the frames it captures, so there's nothing to time
+        if 'burst' in camera.full_res_:
+            continue
+        
+        busy = elapsed if busy is None else 0.9 * busy + 0.1 * elapsed
+        if not governor or start < next_update:
+            continue
+        next_update = start + interval
+        
+        # the frame is only handed over here, the workers do the rest
+        frame_time = busy if worker_time is None else max(busy, worker_time())
+        
+        # no limit if the pipeline keeps up with the sensor, or with the ceiling
+        top = ceiling() if ceiling() > 0 else sensor_fps
+        target = max(min_fps, 1.0 / (frame_time * headroom)) if frame_time > 0 else top
+        target = ceiling() if target >= top else round(target, 1)
+        
+        # small changes aren't worth it
+        if target != limit and (target == 0 or limit == 0 or abs(target - limit) > 0.1 * limit):
+            limit = set_limit(target)
+
+
+def api_updates(pipe, svr_socket):
     
     exposure_time = 0
     analogue_gain = 0.0
@@ -188,26 +1098,8 @@ def publisher(pipe, pub_sock, svr_socket):
     blue_gain = 0.0
 
     for item in pipe:
-        idx = item['idx']
-        idx = f"{idx}".encode('utf-8')
-
-        # take a copy of the metadata so we can change it without impacting
-        #   any other operators
-        metadata = item['metadata'].copy()
-
-        # remove and stats information from the metadata
-        for k in list(metadata.keys()):
-            if k.endswith('StatsOutput'):
-                del metadata[k]
-        
-        # send the metadata
-        metajs = json.dumps(metadata, separators=(',',':'))
-        pub_sock.send_multipart([PubSubCommands.METADATA, idx, metajs.encode('utf-8')], copy=False)
+        metadata = item['metadata']
 
-        # send the jpeg image
-        jpeg = item['jpeg']
-        pub_sock.send_multipart([PubSubCommands.JPEGIMG, idx, jpeg], copy=False)
-        
         # send updates to the api server
         updates = {}
         
@@ -232,6 +1124,50 @@ def publisher(pipe, pub_sock, svr_socket):
         yield item
 
 
+def publisher(pipe, pub_sock, *, prefix=b''):
+
+    metadata_topic = prefix + PubSubCommands.METADATA
+    jpeg_topic = prefix + PubSubCommands.JPEGIMG
+    rgb_topic = prefix + PubSubCommands.RGBIMG
+    tiles_topic = prefix + PubSubCommands.TILES
+    
+    for item in pipe:
+        idx = item['idx']
+        idx = f"{idx}".encode('utf-8')
+
+        # take a copy of the metadata so we can change it without impacting
+        #   any other operators
+        metadata = item['metadata'].copy()
+
+        # remove and stats information from the metadata
+        for k in list(metadata.keys()):
+            if k.endswith('StatsOutput'):
+                del metadata[k]
+        
+        # wall clock time so subscribers can measure their latency
+        metadata['PublishTime'] = time.time()
+        
+        # send the metadata
+        metajs = json.dumps(metadata, separators=(',',':')).encode('utf-8')
+        pub_sock.send_multipart([metadata_topic, idx, metajs], copy=False)
+        metrics.bytes_sent.inc(len(metajs), topic=metadata_topic.decode('utf-8'))
+
+        # send the image, with the header in its own part for rgb images
+        if (jpeg := item.get('jpeg', None)) is not None:
+            pub_sock.send_multipart([jpeg_topic, idx, jpeg], copy=False)
+            metrics.bytes_sent.inc(len(jpeg), topic=jpeg_topic.decode('utf-8'))
+        if (rgb := item.get('rgb', None)) is not None:
+            header, data = rgb
+            pub_sock.send_multipart([rgb_topic, idx, header, data], copy=False)
+            metrics.bytes_sent.inc(len(header) + len(data), topic=rgb_topic.decode('utf-8'))
+        if (tiles := item.get('tiles', None)) is not None:
+            header, jpegs = tiles
+            pub_sock.send_multipart([tiles_topic, idx, header] + jpegs, copy=False)
+            metrics.bytes_sent.inc(len(header) + sum(len(j) for j in jpegs), topic=tiles_topic.decode('utf-8'))
+
+        yield item
+
+
 def fit_cropped(pipe, *, enabled):
 
     enabled = enabled
@@ -249,22 +1185,56 @@ def fit_cropped(pipe, *, enabled):
 
         if enabled:
             image_key = 'raw' if 'raw' in item else 'main'
-            image = item[image_key]['image']
-            image_h, image_w, _ = image.shape
+            entry = item[image_key]
+            image = luma(entry)
+            image_h, image_w = image.shape[:2]
         
             crop_w, crop_h = min(image_w, set_crop_w), min(image_h, set_crop_h)
         
             if crop_w < image_w or crop_h < image_h:
                 x0, x1 = int((image_w - crop_w)/2), int((image_w + crop_w)/2)
                 y0, y1 = int((image_h - crop_h)/2), int((image_h + crop_h)/2)
-                item[image_key]['image'] = image[y0:y1, x0:x1, :]
+                
+                if entry['format'] == 'YUV420':
+                    # keep to even pixels so the chroma planes line up
+                    x0, x1, y0, y1 = x0 & ~1, x1 & ~1, y0 & ~1, y1 & ~1
+                    y, u, v = yuv420_planes(entry['image'])
+                    u, v = (p[y0//2:y1//2, x0//2:x1//2] for p in (u, v))
+                    entry['image'] = yuv420_pack(y[y0:y1, x0:x1], u, v)
+                else:
+                    entry['image'] = image[y0:y1, x0:x1]
 
         yield item
 
 
-def fit_scaled(pipe, *, enabled):
-    # shield the client from this requirement
+def scale_image(entry, scale):
     import cv2
+    
+    if entry['format'] == 'YUV420':
+        # scale each plane, to an even size so the chroma is exactly half
+        image_h, image_w = luma(entry).shape
+        width, height = max(2, int(image_w * scale) & ~1), max(2, int(image_h * scale) & ~1)
+        y, u, v = yuv420_planes(entry['image'])
+        y = cv2.resize(y, (width, height), interpolation=cv2.INTER_AREA)
+        u, v = (cv2.resize(p, (width//2, height//2), interpolation=cv2.INTER_AREA) for p in (u, v))
+        entry['image'] = yuv420_pack(y, u, v)
+    else:
+        entry['image'] = cv2.resize(entry['image'], None, fx=scale, fy=scale)
+
+
+def output_scale(pipe):
+    """Scale the images down further if the thermal governor has asked for it."""
+    
+    for item in pipe:
+        scale = item['metadata'].get('ThermalScale', 1.0)
+        if scale < 1.0:
+            image_key = 'raw' if 'raw' in item else 'main'
+            scale_image(item[image_key], scale)
+        
+        yield item
+
+
+def fit_scaled(pipe, *, enabled):
 
     enabled = enabled
     set_scale_w = sys.maxsize
@@ -281,13 +1251,14 @@ def fit_scaled(pipe, *, enabled):
 
         if enabled:
             image_key = 'raw' if 'raw' in item else 'main'
-            image = item[image_key]['image']
-            image_h, image_w, _ = image.shape
+            entry = item[image_key]
+            image = luma(entry)
+            image_h, image_w = image.shape[:2]
         
             scale_w, scale_h = min(image_w, set_scale_w), min(image_h, set_scale_h)
             if scale_w < image_w or scale_h < image_h:
                 # preserve image aspect ratio
                 scale = min(scale_w/image_w, scale_h/image_h)
-                item[image_key]['image'] = cv2.resize(image, None, fx=scale, fy=scale)
+                scale_image(entry, scale)
 
         yield item
@@ -0,0 +1,234 @@
+import json
+import time
+import zmq
+
+import numpy as np
+
+from .frame_ring import FrameRing
+from .operators import fit_cropped, fit_scaled, output_scale, image_encoder
+from .commands import PubSubCommands
+
+
+# the controls used by the operators running in the worker processes. each worker
+#   only sees some of the frames, so the latest value of each is sent with every frame
+worker_keys = {'FitMode', 'Width', 'Height'}
+
+
+def ring_writer(pipe, ring, task_sock, tasks):
+    """Hand frames to the worker processes, as long as there is a task free for them.
+    
+    The socket's high water mark can't say whether a worker is ready, as the ipc socket
+    buffers many tasks past it, so the tasks are a semaphore that ring_results releases
+    as the results come back.
+    """
+
+    worker_ctrls = {}
+
+    # the tasks are numbered with no gaps, so the results can be put back in order
+    #   without waiting on frames that were never sent to a worker
+    task_no = 0
+
+    for item in pipe:
+        ctrls = item['controls']
+        worker_ctrls.update({ k: ctrls[k] for k in worker_keys & ctrls.keys() })
+
+        # only copy the frame into the ring if the workers can take it
+        if not tasks.acquire(blocking=False):
+            yield item
+            continue
+
+        image_key = 'raw' if 'raw' in item else 'main'
+        image = item[image_key]['image']
+
+        # sequence numbers in the ring must be non-zero
+        seq = task_no + 1
+        slot = ring.write(seq, image)
+
+        metadata = { k: v for k, v in item['metadata'].items() if not k.endswith('StatsOutput') }
+
+        task = {
+            'task': task_no,
+            'idx': item['idx'],
+            'seq': seq,
+            'slot': slot,
+            'key': image_key,
+            'shape': image.shape,
+            'dtype': image.dtype.str,
+            'format': item[image_key]['format'],
+            'metadata': metadata,
+            'controls': worker_ctrls
+        }
+        try:
+            task_sock.send(json.dumps(task, separators=(',',':')).encode('utf-8'), flags=zmq.NOBLOCK)
+            task_no += 1
+        except zmq.Again:
+            tasks.release()
+
+        yield item
+
+
+def shm_publisher(pipe, ring, shm_sock):
+    """Write the uncompressed frames into the ring for consumers on this machine.
+
+    The socket is an XPUB so the copy is only made while something is subscribed.
+    """
+
+    subscribers = 0
+
+    for item in pipe:
+        while shm_sock.poll(timeout=0, flags=zmq.POLLIN):
+            msg = shm_sock.recv()
+            subscribers += 1 if msg[0] == 1 else -1
+
+        if subscribers <= 0:
+            yield item
+            continue
+
+        image_key = 'raw' if 'raw' in item else 'main'
+        image = item[image_key]['image']
+
+        seq = item['idx'] + 1
+        slot = ring.write(seq, image)
+
+        metadata = { k: v for k, v in item['metadata'].items() if not k.endswith('StatsOutput') }
+
+        frame = {
+            'ring': ring.name,
+            'seq': seq,
+            'slot': slot,
+            'key': image_key,
+            'shape': image.shape,
+            'dtype': image.dtype.str,
+            'format': item[image_key]['format'],
+            'metadata': metadata
+        }
+        idx = f"{item['idx']}".encode('utf-8')
+        shm_sock.send_multipart([PubSubCommands.SHMFRAME, idx, json.dumps(frame, separators=(',',':')).encode('utf-8')])
+
+        yield item
+
+
+def ring_reader(task_sock, ring, over):
+
+    while not over.is_set():
+        if task_sock.poll(timeout=200, flags=zmq.POLLIN) == 0:
+            continue
+
+        task = json.loads(task_sock.recv().decode('utf-8'))
+        image_key = task['key']
+
+        # the image is a view straight onto the shared memory
+        image = ring.array(task['slot'], task['shape'], np.dtype(task['dtype']))
+
+        item = {
+            'start_time': time.process_time(),
+            'task': task['task'],
+            'idx': task['idx'],
+            'seq': task['seq'],
+            'slot': task['slot'],
+            'controls': task['controls'],
+            'metadata': task['metadata'],
+            image_key: {
+                'image': image,
+                'format': task['format']
+            }
+        }
+        yield item
+
+
+def ring_sender(pipe, result_sock, ring):
+
+    for item in pipe:
+        task_no = f"{item['task']}".encode('utf-8')
+        idx = f"{item['idx']}".encode('utf-8')
+
+        # if the writer has reused the slot while we were working on it, the image
+        #   is corrupt. send an empty result so the publisher doesn't wait for it.
+        if not ring.valid(item['slot'], item['seq']):
+            result_sock.send_multipart([task_no, idx, b'', b'', b''])
+            continue
+
+        # jpeg images are sent with an empty header
+        header, data = item['rgb'] if 'rgb' in item else (b'', item['jpeg'])
+
+        # the cpu time the frame took, in microseconds, so the fps governor knows what the workers
+        #   can do. unlike the elapsed time, it doesn't change with how busy the cpus are
+        item['metadata']['WorkerTime'] = int((time.process_time() - item['start_time']) * 1000000)
+
+        metajs = json.dumps(item['metadata'], separators=(',',':')).encode('utf-8')
+        result_sock.send_multipart([task_no, idx, metajs, data, header], copy=False)
+
+        yield item
+
+
+def ring_results(result_sock, tasks, *, window, over):
+
+    pending = {}
+    next_task = 0
+
+    while not over.is_set():
+        if result_sock.poll(timeout=200, flags=zmq.POLLIN) == 0:
+            continue
+
+        task_no, idx, metajs, data, header = result_sock.recv_multipart()
+        task_no = int(task_no.decode('utf-8'))
+        idx = int(idx.decode('utf-8'))
+        tasks.release()
+
+        # too late, we've already moved past it
+        if task_no < next_task:
+            continue
+
+        item = None
+        if len(data):
+            item = {
+                'idx': idx,
+                'metadata': json.loads(metajs.decode('utf-8'))
+            }
+            if len(header):
+                item['rgb'] = (header, data)
+            else:
+                item['jpeg'] = data
+        pending[task_no] = item
+
+        # release results in the order the tasks were sent. every task gets a result,
+        #   so the window only matters if a worker goes away in the middle of one.
+        while len(pending):
+            lowest = min(pending)
+            if lowest != next_task and len(pending) <= window:
+                break
+
+            next_task = lowest + 1
+            if (item := pending.pop(lowest)) is not None:
+                yield item
+
+
+def ring_worker(ring_name, task_url, result_url, encoding, over):
+    # the raw operators import cv2, so only pull them in here
+    from .operators_raw import raw_convert
+
+    context = zmq.Context()
+
+    task_sock = context.socket(zmq.PULL)
+    task_sock.set_hwm(1)
+    task_sock.connect(task_url)
+
+    result_sock = context.socket(zmq.PUSH)
+    result_sock.connect(result_url)
+
+    ring = FrameRing(ring_name)
+
+    pipe = ring_reader(task_sock, ring, over)
+
+    pipe = raw_convert(pipe)
+    pipe = fit_cropped(pipe, enabled=False)
+    pipe = fit_scaled(pipe, enabled=True)
+    pipe = output_scale(pipe)
+    pipe = image_encoder(pipe, encoding)
+    pipe = ring_sender(pipe, result_sock, ring)
+
+    for item in pipe:
+        pass
+
+    ring.close()
+    context.destroy(linger=0)
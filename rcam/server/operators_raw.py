@@ -20,60 +20,66 @@ bayer_scale = {
     'SRGGB16': 1.0,
 }
 
-def raw_gamma8(pipe):
-    
-    scale = 255.0 / np.power(65535, 1.0/2.2)
-
-    for item in pipe:
-        image = item['raw']['image']
-        image_format = item['raw']['format']
-        
-        # scale the image up to the top part of the 16bit word
-        image = image * bayer_scale[image_format]
+def demosaic(image, image_format, black_level):
+    # scale the image up to the top part of the 16bit word
+    image = image * bayer_scale[image_format]
 
-        # subtract the sensor black levels
-        black_level = item['metadata']['SensorBlackLevels'][0]
-        image = np.maximum(image, black_level) - black_level
+    # subtract the sensor black levels
+    image = np.maximum(image, black_level) - black_level
 
-        # demosaic the image
-        bayer_code = bayer_codes[image_format]
-        image = cv2.demosaicing(image.astype(np.uint16), bayer_code)
-        
-        # apply the gamma encoding and convert to 8bit range
-        image = np.power(image, 1.0/2.2) * scale
-        image = image.astype(np.uint8)
+    # demosaic the image
+    bayer_code = bayer_codes[image_format]
+    return cv2.demosaicing(image.astype(np.uint16), bayer_code)
 
-        # store the image back in the item
-        item['raw']['image'] = image
 
-        yield item
+def gamma8(image, image_format, black_level):
+    scale = 255.0 / np.power(65535, 1.0/2.2)
+    
+    image = demosaic(image, image_format, black_level)
+    
+    # apply the gamma encoding and convert to 8bit range
+    image = np.power(image, 1.0/2.2) * scale
+    return image.astype(np.uint8)
 
 
-def raw_linear8(pipe):
-    
+def linear8(image, image_format, black_level):
     scale = 255.0 / 65535.0
+    
+    image = demosaic(image, image_format, black_level)
+    
+    # convert to 8bit range
+    image = image * scale
+    return image.astype(np.uint8)
 
-    for item in pipe:
-        image = item['raw']['image']
-        image_format = item['raw']['format']
 
-        # scale the image up to the top part of the 16bit word
-        image = image * bayer_scale[image_format]
+converters = {
+    'rl8': linear8,
+    'rg8': gamma8,
+}
 
-        # subtract the sensor black levels
-        black_level = item['metadata']['SensorBlackLevels'][0]
-        image = np.maximum(image, black_level) - black_level
 
-        # demosaic the image
-        bayer_code = bayer_codes[image_format]
-        image = cv2.demosaicing(image.astype(np.uint16), bayer_code)
+def raw_convert(pipe, image_type=None):
+    """Convert the raw images to 8bit rgb.
+    
+    The image type can change while the server is running, so unless it's given it's
+    taken from each frame's metadata.
+    """
+    
+    for item in pipe:
+        convert = converters.get(image_type or item['metadata'].get('ImageType', None), None)
+        if 'raw' not in item or convert is None:
+            yield item
+            continue
+        
+        black_level = item['metadata']['SensorBlackLevels'][0]
+        item['raw']['image'] = convert(item['raw']['image'], item['raw']['format'], black_level)
+        
+        yield item
 
-        # apply the gamma encoding and convert to 8bit range
-        image = image * scale
-        image = image.astype(np.uint8)
 
-        # store the image back in the item
-        item['raw']['image'] = image
+def raw_gamma8(pipe):
+    return raw_convert(pipe, 'rg8')
 
-        yield item
 
+def raw_linear8(pipe):
+    return raw_convert(pipe, 'rl8')
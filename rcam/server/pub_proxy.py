@@ -0,0 +1,128 @@
+from collections import deque
+import json
+import threading
+import zmq
+
+from .commands import PubSubCommands
+from .operators import max_burst
+
+
+class PubProxy(threading.Thread):
+    """Forwards the messages from each camera's publishers to the shared publish endpoints.
+
+    If a pairing tolerance is given, frames from all the cameras with SensorTimestamps
+    within the tolerance of each other are also published together on the pair topics.
+    """
+
+    def __init__(self, context, pub_url, camera_urls, side_url, camera_side_urls, *, pair_tolerance=0):
+        super().__init__()
+        self.over = False
+
+        self.pub_sock = context.socket(zmq.PUB)
+        self.pub_sock.set_hwm(2)
+        self.pub_sock.bind(pub_url)
+
+        self.sub_sock = context.socket(zmq.SUB)
+        self.sub_sock.set_hwm(2)
+        for camera_url in camera_urls.values():
+            self.sub_sock.connect(camera_url)
+        self.sub_sock.setsockopt(zmq.SUBSCRIBE, b'')
+
+        # bursts and stills aren't dropped on the way, so the side sockets hold a whole burst
+        self.side_pub = context.socket(zmq.PUB)
+        self.side_pub.set_hwm(2 * max_burst + 8)
+        self.side_pub.bind(side_url)
+
+        self.side_sub = context.socket(zmq.SUB)
+        self.side_sub.set_hwm(2 * max_burst + 8)
+        for camera_side_url in camera_side_urls.values():
+            self.side_sub.connect(camera_side_url)
+        self.side_sub.setsockopt(zmq.SUBSCRIBE, b'')
+
+        # the tolerance is in milliseconds, the timestamps in nanoseconds
+        self.pair_tolerance = int(pair_tolerance * 1000000)
+        self.pair_idx = 0
+
+        self.metadata = {}
+        self.frames = { prefix: deque(maxlen=4) for prefix in camera_urls.keys() }
+
+        self.pair_metadata_topic = PubSubCommands.PAIR_PREFIX + PubSubCommands.METADATA
+        self.pair_jpeg_topic = PubSubCommands.PAIR_PREFIX + PubSubCommands.JPEGIMG
+
+    def run(self):
+        print("pub_proxy: start")
+
+        poller = zmq.Poller()
+        poller.register(self.sub_sock, zmq.POLLIN)
+        poller.register(self.side_sub, zmq.POLLIN)
+
+        while self.over == False:
+            events = dict(poller.poll(200))
+
+            if self.side_sub in events:
+                self.side_pub.send_multipart(self.side_sub.recv_multipart(), copy=False)
+
+            if self.sub_sock not in events:
+                continue
+
+            msg = self.sub_sock.recv_multipart()
+            self.pub_sock.send_multipart(msg)
+
+            # only the jpeg images are paired, rgb images have an extra header part
+            if self.pair_tolerance > 0 and len(msg) == 3:
+                self.handle_pairing(*msg)
+
+        print("pub_proxy: finish")
+
+    def handle_pairing(self, topic, idx, data):
+        prefix, _, tag = topic.rpartition(b'/')
+        prefix += b'/'
+
+        if tag == PubSubCommands.METADATA:
+            self.metadata[prefix] = (idx, data)
+            return
+
+        if tag != PubSubCommands.JPEGIMG:
+            return
+
+        # the metadata is always sent just before the image
+        meta_idx, metajs = self.metadata.pop(prefix, (None, None))
+        if meta_idx != idx:
+            return
+
+        timestamp = json.loads(metajs.decode('utf-8')).get('SensorTimestamp', None)
+        if timestamp is None:
+            return
+
+        frame = (timestamp, metajs, data)
+        self.frames[prefix].append(frame)
+
+        # find the closest frame from every other camera
+        matches = {}
+        for other, frames in self.frames.items():
+            if other == prefix:
+                matches[other] = frame
+                continue
+
+            if len(frames) == 0:
+                return
+
+            closest = min(frames, key=lambda f: abs(f[0] - timestamp))
+            if abs(closest[0] - timestamp) > self.pair_tolerance:
+                return
+            matches[other] = closest
+
+        # drop the matched frames and everything before them
+        for other, match in matches.items():
+            frames = self.frames[other]
+            while len(frames) and frames[0][0] <= match[0]:
+                frames.popleft()
+
+        # publish the set in camera order
+        prefixes = sorted(matches.keys())
+        pair_idx = f"{self.pair_idx}".encode('utf-8')
+        self.pair_idx += 1
+
+        metajs = b'[' + b','.join(matches[p][1] for p in prefixes) + b']'
+        self.pub_sock.send_multipart([self.pair_metadata_topic, pair_idx, metajs])
+        self.pub_sock.send_multipart([self.pair_jpeg_topic, pair_idx] + [matches[p][2] for p in prefixes])
@@ -1,56 +1,226 @@
 from itertools import count
+import multiprocessing as mp
+import os
+import tempfile
 import threading
 import zmq
 
-from .operators import control, capture, jpeg_encoder, publisher
+from .operators import control, capture, isp_capture, sensor_drops, frame_rate, image_encoder, publisher, api_updates, burst, still, motion_gate, max_burst
 from .operators import focus, exposure, whitebalance
-from .operators import fit_scaled, fit_cropped
-from .operators_raw import raw_linear8, raw_gamma8
+from .operators import fit_scaled, fit_cropped, output_scale, thermal_governor
+from .operators_raw import raw_convert
+from .operators_mp import ring_writer, ring_results, ring_worker, shm_publisher
+from .frame_ring import FrameRing
+from .metrics import Probe, frames_captured, frames_processed, frames_published, encoder_queue
 
 
 class PubServer(threading.Thread):
-    def __init__(self, context, pub_url, svr_sockname, *, camera, ae_enabled, dtype):
+    def __init__(self, context, pub_url, side_pub_url, svr_sockname, *, camera, ae_enabled, dtype, workers=0, prefix=b'', shm_url=None, shm_slots=4, encoding='jpeg', tile_size=128, refresh=2.0, motion_threshold=0, heartbeat=5.0, max_fps=0, fps_governor=False, thermal=False, thermal_ladder=None):
         super().__init__()
 
+        self.context = context
+        self.svr_sockname = svr_sockname
+
         self.pub_sock = context.socket(zmq.PUB)
         self.pub_sock.set_hwm(2)
         self.pub_sock.bind(pub_url)
-        
+
         self.svr_sock = context.socket(zmq.PAIR)
         self.svr_sock.connect(f"inproc://{svr_sockname}")
-        
+
+        # extra messages, like bursts, are passed to the side publisher on the side channel
+        self.side_url = f"inproc://side-{svr_sockname}"
+        self.side_sock = context.socket(zmq.PULL)
+        self.side_sock.bind(self.side_url)
+
+        # bursts and stills are sent once and can't be caught again, so they have a
+        #   publisher of their own that holds a whole burst rather than dropping it
+        self.side_pub = context.socket(zmq.PUB)
+        self.side_pub.set_hwm(2 * max_burst + 8)
+        self.side_pub.bind(side_pub_url)
+        self.side_over = threading.Event()
+
+        # uncompressed frames for consumers on this machine are announced on this
+        #   socket and passed through shared memory
+        self.shm_sock = None
+        self.shm_slots = shm_slots
+        if shm_url is not None:
+            self.shm_sock = context.socket(zmq.XPUB)
+            self.shm_sock.setsockopt(zmq.XPUB_VERBOSER, 1)
+            self.shm_sock.set_hwm(shm_slots)
+            self.shm_sock.bind(shm_url)
+
         self.ae_enabled = ae_enabled
         self.dtype = dtype
-        
-        self.arrays = arrays = ["main"]
-        if self.dtype != 'rgb':
-            self.arrays.append("raw")
+        # tiles are sent relative to the previous frame, so they need the frames in one pipeline
+        if encoding == 'tiles' and workers > 0:
+            raise ValueError("tiles encoding can't be used with worker processes")
+
+        self.encoding = encoding
+        self.tile_size = tile_size
+        self.refresh = refresh
+        self.motion_threshold = motion_threshold
+        self.heartbeat = heartbeat
+        self.max_fps = max_fps
+        self.fps_governor = fps_governor
+        self.thermal = thermal
+        self.thermal_ladder = thermal_ladder
+        self.workers = workers
+        self.prefix = prefix
+
         self.camera = camera
-        
+        self.camera_label = str(getattr(camera, 'camera_idx', 0))
+        self.written_idx = 0
+        self.worker_time = 0.0
+
     def run(self):
         print("pub_server: start")
-        
+
         self.camera.start()
 
+        side_thread = threading.Thread(target=self.run_side)
+        side_thread.start()
+
+        label = self.camera_label
+
         pipe = control(self.svr_sock)
-        pipe = capture(pipe, self.camera, self.arrays)
+        pipe = Probe(label, 'start')(pipe)
+        if getattr(self.camera, 'isp_', False):
+            pipe = isp_capture(pipe, self.camera)
+        else:
+            pipe = capture(pipe, self.camera, dtype=self.dtype)
+        pipe = sensor_drops(pipe, camera_label=label)
+        pipe = Probe(label, 'capture', frames_captured)(pipe)
+        if self.thermal:
+            pipe = thermal_governor(pipe, ladder=self.thermal_ladder)
+        worker_time = (lambda: self.worker_time) if self.workers > 0 else None
+        pipe = frame_rate(pipe, self.camera, max_fps=self.max_fps, governor=self.fps_governor, worker_time=worker_time)
         pipe = focus(pipe, self.camera)
         pipe = exposure(pipe, self.camera)
         pipe = whitebalance(pipe, self.camera)
-        
-        if self.dtype == 'rl8':
-            pipe = raw_linear8(pipe)
-        elif self.dtype == 'rg8':
-            pipe = raw_gamma8(pipe)
-        
+        pipe = api_updates(pipe, self.svr_sock)
+        pipe = Probe(label, 'controls')(pipe)
+        pipe = still(pipe, self.camera, self.context, self.side_url)
+        pipe = burst(pipe, self.camera, self.context, self.side_url)
+        pipe = Probe(label, 'burst')(pipe)
+
+        shm_ring = None
+        if self.shm_sock is not None:
+            # big enough for any mode, so the mode can be switched
+            shm_ring = FrameRing(nslots=self.shm_slots, slot_size=self.camera.max_framesize_)
+            pipe = shm_publisher(pipe, shm_ring, self.shm_sock)
+
+        # frames without motion stop here, before any scaling, encoding or sending
+        pipe = motion_gate(pipe, threshold=self.motion_threshold, heartbeat=self.heartbeat)
+        pipe = Probe(label, 'motion')(pipe)
+
+        if self.workers > 0:
+            self.run_workers(pipe)
+            self.close_shm(shm_ring)
+            self.side_over.set()
+            side_thread.join()
+            print("pub_server: finish")
+            return
+
+        pipe = raw_convert(pipe)
+
         pipe = fit_cropped(pipe, enabled=False)
         pipe = fit_scaled(pipe, enabled=True)
-        pipe = jpeg_encoder(pipe)
-        pipe = publisher(pipe, self.pub_sock, self.svr_sock)
-        
+        pipe = output_scale(pipe)
+        pipe = Probe(label, 'fit')(pipe)
+        pipe = image_encoder(pipe, self.encoding, tile_size=self.tile_size, refresh=self.refresh)
+        pipe = Probe(label, 'encode', frames_processed)(pipe)
+        pipe = publisher(pipe, self.pub_sock, prefix=self.prefix)
+        pipe = Probe(label, 'publish', frames_published)(pipe)
+
         for item in pipe:
             if item['controls'].get('Over', False):
                 break
 
+        self.close_shm(shm_ring)
+        self.side_over.set()
+        side_thread.join()
         print("pub_server: finish")
 
+    def run_side(self):
+        # passed on as they arrive, at whatever rate the link allows, without waiting for frames
+        while not self.side_over.is_set():
+            if self.side_sock.poll(timeout=200, flags=zmq.POLLIN) == 0:
+                continue
+            tag, idx, *data = self.side_sock.recv_multipart()
+            self.side_pub.send_multipart([self.prefix + tag, idx] + data, copy=False)
+
+    def close_shm(self, ring):
+        if ring is None:
+            return
+        self.shm_sock.close(linger=0)
+        ring.close()
+
+    def run_workers(self, pipe):
+        # the frames are passed to the worker processes through shared memory and
+        #   the results are published from a separate thread in the order captured.
+        #   there's a slot for every frame that can be queued, with a worker or in
+        #   the reordering window, so none are reused while they're still needed
+        window = 2*self.workers
+        tasks = threading.Semaphore(window)
+        ring = FrameRing(nslots=window + self.workers + 2, slot_size=self.camera.max_framesize_)
+
+        base_url = f"ipc://{tempfile.gettempdir()}/rcam-{self.svr_sockname}"
+        task_url = f"{base_url}-tasks"
+        result_url = f"{base_url}-results"
+
+        task_sock = self.context.socket(zmq.PUSH)
+        task_sock.set_hwm(1)
+        task_sock.bind(task_url)
+
+        result_sock = self.context.socket(zmq.PULL)
+        result_sock.bind(result_url)
+
+        # use spawn so the workers don't inherit the zmq context or the camera
+        mpctx = mp.get_context('spawn')
+        over = mpctx.Event()
+
+        procs = []
+        for _ in range(self.workers):
+            proc = mpctx.Process(target=ring_worker, args=(ring.name, task_url, result_url, self.encoding, over), daemon=True)
+            proc.start()
+            procs.append(proc)
+
+        pub_over = threading.Event()
+        pub_thread = threading.Thread(target=self.run_publisher, args=(result_sock, tasks, window, pub_over))
+        pub_thread.start()
+
+        pipe = ring_writer(pipe, ring, task_sock, tasks)
+        for item in pipe:
+            self.written_idx = item['idx']
+            if item['controls'].get('Over', False):
+                break
+
+        over.set()
+        for proc in procs:
+            proc.join()
+
+        pub_over.set()
+        pub_thread.join()
+
+        task_sock.close(linger=0)
+        result_sock.close(linger=0)
+        ring.close()
+
+    def run_publisher(self, result_sock, tasks, window, over):
+        label = self.camera_label
+
+        # the results are new items, so the time in the workers isn't measured, only the drops
+        pipe = ring_results(result_sock, tasks, window=window, over=over)
+        pipe = Probe(label, 'encode', frames_processed)(pipe)
+        pipe = publisher(pipe, self.pub_sock, prefix=self.prefix)
+        pipe = Probe(label, 'publish', frames_published)(pipe)
+        for item in pipe:
+            # frames sent to the workers and not yet published
+            encoder_queue.set(max(0, self.written_idx - item['idx']), camera=label)
+            
+            # the workers share the frames, so each one costs its cpu time divided between the
+            #   workers that can run at once
+            if (worker_time := item['metadata'].get('WorkerTime', None)) is not None:
+                frame_time = worker_time / 1000000 / min(self.workers, len(os.sched_getaffinity(0)))
+                self.worker_time = frame_time if self.worker_time == 0.0 else 0.9 * self.worker_time + 0.1 * frame_time
@@ -0,0 +1,155 @@
+import os
+import re
+import json
+import time
+import threading
+import zmq
+
+from PIL import Image
+import numpy as np
+
+from .operators import control, image_encoder, publisher, motion_gate
+from .operators import fit_scaled, fit_cropped
+from .metrics import Probe, frames_captured, frames_processed, frames_published
+
+
+image_re = re.compile(r"^.+\.(jpe?g|png|tiff?)$", re.IGNORECASE)
+
+# the raw images the recorder saves alongside its stills
+raw_re = re.compile(r"^.+-raw\.(png|tiff?)$", re.IGNORECASE)
+
+
+def find_frames(replay_dir):
+    """Find the images in a directory and their json sidecars, if they have one."""
+
+    frames = []
+    for name in sorted(os.listdir(replay_dir)):
+        if image_re.match(name) is None or raw_re.match(name) is not None:
+            continue
+
+        image_path = os.path.join(replay_dir, name)
+        metadata_path = os.path.splitext(image_path)[0] + ".json"
+        if not os.path.exists(metadata_path):
+            metadata_path = None
+
+        frames.append((image_path, metadata_path))
+
+    if len(frames) == 0:
+        raise ValueError(f"no images found in {replay_dir}")
+
+    return frames
+
+
+def frame_interval(prev_metadata, metadata, default):
+    """The time between two recorded frames, in seconds."""
+
+    prev_ts = prev_metadata.get('SensorTimestamp', None)
+    ts = metadata.get('SensorTimestamp', None)
+    if prev_ts is not None and ts is not None and ts > prev_ts:
+        return (ts - prev_ts) / 1e9
+
+    if (fd := metadata.get('FrameDuration', None)) is not None:
+        return fd / 1e6
+
+    return default
+
+
+def replay(pipe, frames, *, fps, loop):
+
+    # with no fps, play back at the recorded rate
+    default_interval = 1.0 / (fps if fps > 0 else 10.0)
+
+    position = 0
+    prev_metadata = {}
+    next_time = time.monotonic()
+
+    for item in pipe:
+        # there's no frame to go with a shutdown, so just stop the pipeline
+        if item['controls'].get('Over', False):
+            return
+
+        if position == len(frames):
+            if not loop:
+                return
+            position = 0
+            prev_metadata = {}
+
+        image_path, metadata_path = frames[position]
+        position += 1
+
+        metadata = {}
+        if metadata_path is not None:
+            with open(metadata_path) as f:
+                metadata = json.load(f)
+        
+        # the drop counts are from the recording, this server counts its own
+        for key in ('DroppedFrames', 'SensorDropped', 'StageDrops'):
+            metadata.pop(key, None)
+
+        image = np.array(Image.open(image_path).convert('RGB'))
+
+        # wait until it's time for this frame
+        interval = default_interval if fps > 0 else frame_interval(prev_metadata, metadata, default_interval)
+        prev_metadata = metadata
+
+        next_time = max(next_time + interval, time.monotonic() - interval)
+        if (delay := next_time - time.monotonic()) > 0:
+            time.sleep(delay)
+
+        image_h, image_w, _ = image.shape
+        metadata['ImageSize'] = (image_w, image_h)
+        metadata['ReplayFile'] = os.path.basename(image_path)
+
+        item['metadata'] = metadata
+        item['main'] = {
+            'image': image,
+            'format': 'RGB888',
+            'size': (image_w, image_h)
+        }
+
+        yield item
+
+
+class ReplayServer(threading.Thread):
+    def __init__(self, context, pub_url, svr_sockname, *, replay_dir, fps=0, loop=True, encoding='jpeg', tile_size=128, refresh=2.0, motion_threshold=0, heartbeat=5.0):
+        super().__init__()
+        self.over = False
+
+        self.pub_sock = context.socket(zmq.PUB)
+        self.pub_sock.set_hwm(2)
+        self.pub_sock.bind(pub_url)
+
+        self.svr_sock = context.socket(zmq.PAIR)
+        self.svr_sock.connect(f"inproc://{svr_sockname}")
+
+        self.frames = find_frames(replay_dir)
+        self.fps = fps
+        self.loop = loop
+        self.encoding = encoding
+        self.tile_size = tile_size
+        self.refresh = refresh
+        self.motion_threshold = motion_threshold
+        self.heartbeat = heartbeat
+
+    def run(self):
+        print(f"replay_server: start, {len(self.frames)} frames")
+
+        label = 'replay'
+
+        pipe = control(self.svr_sock)
+        pipe = replay(pipe, self.frames, fps=self.fps, loop=self.loop)
+        pipe = Probe(label, 'capture', frames_captured)(pipe)
+        pipe = motion_gate(pipe, threshold=self.motion_threshold, heartbeat=self.heartbeat)
+        pipe = Probe(label, 'motion')(pipe)
+        pipe = fit_cropped(pipe, enabled=False)
+        pipe = fit_scaled(pipe, enabled=True)
+        pipe = image_encoder(pipe, self.encoding, tile_size=self.tile_size, refresh=self.refresh)
+        pipe = Probe(label, 'encode', frames_processed)(pipe)
+        pipe = publisher(pipe, self.pub_sock)
+        pipe = Probe(label, 'publish', frames_published)(pipe)
+
+        for item in pipe:
+            if self.over:
+                break
+
+        print("replay_server: finish")
@@ -0,0 +1,127 @@
+import uuid
+
+from .api_server import ApiServer
+from .api_router import ApiRouter
+from .pub_server import PubServer
+from .pub_proxy import PubProxy
+from .metrics import MetricsServer
+
+from .camera import Camera
+from .commands import topic_prefix, shm_url
+
+
+class Server:
+    def __init__(self, context, api_url, pub_url, side_url, *, camera_ids, mode, max_fps, exposure_time, analogue_gain, hflip, vflip, preview, tuning_file, dtype, workers=0, pair_tolerance=0, cache=True, shm=False, shm_slots=4, encoding='jpeg', tile_size=128, refresh=2.0, motion_threshold=0, heartbeat=5.0, isp=False, fps_governor=False, thermal=False, thermal_ladder=None, metrics_port=0):
+
+        # with a single camera, the servers bind directly to the urls. with more than
+        #   one, each camera's servers bind to inproc urls and the router and proxy
+        #   share the real urls between them.
+        multi_camera = len(camera_ids) > 1
+
+        self.pub_svrs = []
+        self.api_svrs = []
+        self.pub_proxy = None
+
+        api_urls = {}
+        pub_urls = {}
+        side_urls = {}
+
+        api_port = int(api_url.rsplit(':', 1)[1])
+
+        for camera_id in camera_ids:
+            svr_sockname = str(uuid.uuid4())
+
+            prefix = b''
+            cam_api_url, cam_pub_url, cam_side_url = api_url, pub_url, side_url
+            if multi_camera:
+                prefix = topic_prefix(camera_id)
+                cam_api_url = api_urls[prefix] = f"inproc://api-{svr_sockname}"
+                cam_pub_url = pub_urls[prefix] = f"inproc://pub-{svr_sockname}"
+                cam_side_url = side_urls[prefix] = f"inproc://side-pub-{svr_sockname}"
+
+            cam_shm_url = None
+            if shm:
+                cam_shm_url = shm_url(api_port, camera_id if multi_camera else None)
+
+            cam = Camera(
+                camera_id,
+                mode,
+                max_fps=max_fps,
+                vflip=vflip,
+                hflip=hflip,
+                exposure_time=exposure_time,
+                analogue_gain=analogue_gain,
+                preview=preview,
+                tuning_file=tuning_file,
+                cache=cache,
+                isp=(isp and dtype == 'rgb'),
+                yuv=(dtype in ('yuv', 'y8'))
+            )
+            if preview:
+                cam.start_preview_()
+                preview = False
+
+            min_ag, max_ag, _ = cam.camera_controls['AnalogueGain']
+            min_et, max_et, _ = cam.camera_controls['ExposureTime']
+
+            pub_svr = PubServer(context, cam_pub_url, cam_side_url, svr_sockname,
+                camera=cam,
+                ae_enabled=(exposure_time == 0),
+                dtype=dtype,
+                workers=workers,
+                prefix=prefix,
+                shm_url=cam_shm_url,
+                shm_slots=shm_slots,
+                encoding=encoding,
+                tile_size=tile_size,
+                refresh=refresh,
+                motion_threshold=motion_threshold,
+                heartbeat=heartbeat,
+                max_fps=max_fps,
+                fps_governor=fps_governor,
+                thermal=thermal,
+                thermal_ladder=thermal_ladder
+            )
+            api_svr = ApiServer(context, cam_api_url, svr_sockname,
+                    min_ag=min_ag,
+                    max_ag=max_ag,
+                    min_et=min_et,
+                    max_et=max_et
+            )
+            self.pub_svrs.append(pub_svr)
+            self.api_svrs.append(api_svr)
+
+        self.threads = self.pub_svrs + self.api_svrs
+
+        if multi_camera:
+            self.threads.append(ApiRouter(context, api_url, api_urls))
+            self.pub_proxy = PubProxy(context, pub_url, pub_urls, side_url, side_urls, pair_tolerance=pair_tolerance)
+
+        self.metrics_svr = None
+        if metrics_port > 0:
+            self.metrics_svr = MetricsServer('0.0.0.0', metrics_port)
+
+    def start(self):
+        if self.metrics_svr is not None:
+            self.metrics_svr.start()
+        if self.pub_proxy is not None:
+            self.pub_proxy.start()
+        for thread in self.threads:
+            thread.start()
+
+    def set_over(self):
+        for thread in self.threads:
+            thread.over = True
+
+    def join(self):
+        for thread in self.threads:
+            thread.join()
+        
+        # the proxy has nothing to forward once all the publishers have finished
+        if self.pub_proxy is not None:
+            self.pub_proxy.over = True
+            self.pub_proxy.join()
+
+        if self.metrics_svr is not None:
+            self.metrics_svr.over = True
+            self.metrics_svr.join()
@@ -0,0 +1,79 @@
+import json
+import zmq
+
+import numpy as np
+
+from .protocol import PubSubCommands
+from .drops import DropCounter
+from .server.frame_ring import FrameRing
+
+
+class ShmSubscriber:
+    """Receive uncompressed frames from a server running on the same machine.
+
+    The images are views straight onto the server's shared memory, so there is no
+    copy and no decode. The server keeps writing to the ring while the frame is in
+    use, so check `valid` once finished with an image to know it wasn't overwritten.
+    The frames received and dropped are counted in `drops`.
+    """
+
+    def __init__(self, zmq_context, shm_url, *, hwm=1):
+        self.sub_sock = zmq_context.socket(zmq.SUB)
+        self.sub_sock.setsockopt(zmq.RCVHWM, hwm)
+        self.sub_sock.connect(shm_url)
+        self.sub_sock.setsockopt(zmq.SUBSCRIBE, PubSubCommands.SHMFRAME)
+
+        self.ring = None
+        self.drops = DropCounter()
+
+    def recv(self, timeout=None):
+        """Return the next frame, or None if nothing arrived within the timeout in milliseconds."""
+
+        while True:
+            if self.sub_sock.poll(timeout=timeout, flags=zmq.POLLIN) == 0:
+                return None
+
+            _, idx, data = self.sub_sock.recv_multipart()
+            idx = int(idx.decode('utf-8'))
+            frame = json.loads(data.decode('utf-8'))
+            self.drops.seen(idx, frame['metadata'])
+
+            # the ring changes if the server is restarted
+            if self.ring is None or self.ring.name != frame['ring']:
+                if self.ring is not None:
+                    self.ring.close()
+                self.ring = FrameRing(frame['ring'], track=False)
+
+            # already overwritten, wait for the next one
+            if not self.ring.valid(frame['slot'], frame['seq']):
+                self.drops.drop('overwritten')
+                continue
+
+            image_key = frame['key']
+            image = self.ring.array(frame['slot'], frame['shape'], np.dtype(frame['dtype']))
+
+            item = {
+                'idx': idx,
+                'seq': frame['seq'],
+                'slot': frame['slot'],
+                'metadata': frame['metadata'],
+                image_key: {
+                    'image': image,
+                    'format': frame['format']
+                }
+            }
+            self.drops.deliver()
+            return item
+
+    def valid(self, item):
+        return self.ring is not None and self.ring.valid(item['slot'], item['seq'])
+
+    def frames(self):
+        while True:
+            yield self.recv()
+
+    def close(self):
+        self.sub_sock.close(linger=0)
+        if self.ring is not None:
+            self.ring.close()
+            self.ring = None
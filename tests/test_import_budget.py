@@ -0,0 +1,47 @@
+import json
+import os
+import subprocess
+import sys
+
+
+# control scripts run from cron spend most of their time importing, so `import rcam`
+#   has to stay cheap. these are well above what it costs now
+MAX_IMPORT_SECONDS = 0.1
+MAX_NEW_MODULES = 10
+
+# the client, server and image modules that must only load when they're used
+HEAVY_MODULES = ('zmq', 'numpy', 'PIL', 'psutil', 'picamera2', 'libcamera', 'cv2', 'rcam.server')
+
+repo_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+probe = """
+import json, sys, time
+before = set(sys.modules)
+start = time.perf_counter()
+import rcam
+elapsed = time.perf_counter() - start
+print(json.dumps({'elapsed': elapsed, 'modules': sorted(set(sys.modules) - before)}))
+"""
+
+
+def import_rcam():
+    # a fresh interpreter, so nothing is already imported
+    result = subprocess.run([sys.executable, '-c', probe], cwd=repo_dir, capture_output=True, text=True, check=True)
+    return json.loads(result.stdout)
+
+
+def test_import_loads_no_heavy_modules():
+    modules = import_rcam()['modules']
+    loaded = [m for m in modules if m.split('.')[0] in HEAVY_MODULES or m.startswith('rcam.server')]
+    assert loaded == []
+
+
+def test_import_module_count():
+    modules = import_rcam()['modules']
+    assert len(modules) <= MAX_NEW_MODULES, modules
+
+
+def test_import_time():
+    # the best of a few runs, so a busy machine doesn't fail it
+    elapsed = min(import_rcam()['elapsed'] for _ in range(3))
+    assert elapsed <= MAX_IMPORT_SECONDS